@@ -0,0 +1,244 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+End-to-end benchmark of the collection path on fake local nodes
+
+Builds a NodeManager from a generated nodes_json with loopback (127.x.y.z)
+nodes, for which utils.ssh_node runs scripts with a local bash instead of
+ssh. The collection scripts replay canned outputs generated by
+benchmarks.synthetic, after a per-node latency and with a per-node chance
+of failure, so run_batch concurrency, timeouts and memory can be measured
+without a Fuel environment.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from benchmarks import synthetic  # noqa
+from cudet import configuration  # noqa
+from cudet import main as cudet_main  # noqa
+from cudet import nodes  # noqa
+from cudet import timings  # noqa
+
+
+REPLAY_SCRIPT = '''sleep "${CUDET_FAKE_LATENCY:-0}"
+if [ "${CUDET_FAKE_EXIT:-0}" -ne 0 ]; then
+    echo "fake failure" >&2
+    exit "$CUDET_FAKE_EXIT"
+fi
+cat "$CUDET_FAKE_OUTPUT"
+'''
+
+
+def loopback_ip(node_id):
+    return '127.%d.%d.%d' % (node_id // 65536 % 256 + 1,
+                             node_id // 256 % 256, node_id % 256)
+
+
+def write_nodes_json(filename, cloud):
+    data = [{'id': n.id,
+             'name': n.name,
+             'fqdn': n.fqdn,
+             'mac': n.mac,
+             'cluster': n.cluster,
+             'roles': n.roles,
+             'os_platform': n.os_platform,
+             'online': True,
+             'status': 'ready',
+             'ip': n.ip} for n in cloud]
+    with open(filename, 'w') as f:
+        json.dump(data, f)
+
+
+def write_rq(workdir, os_platform):
+    """Writes an rq directory whose scripts replay canned outputs"""
+    rqdir = os.path.join(workdir, 'rq')
+    scripts = ['packagelist-%s' % os_platform,
+               'packages-md5-verify-%s' % os_platform]
+    if not os.path.isdir(os.path.join(rqdir, nodes.Node.skey)):
+        os.makedirs(os.path.join(rqdir, nodes.Node.skey))
+    for script in scripts:
+        with open(os.path.join(rqdir, nodes.Node.skey, script), 'w') as f:
+            f.write(REPLAY_SCRIPT)
+    rqfile = os.path.join(workdir, 'rq.yaml')
+    with open(rqfile, 'w') as f:
+        f.write('scripts:\n  by_os_platform:\n    %s:\n' % os_platform)
+        for script in scripts:
+            f.write('      - %s\n' % script)
+    return rqdir, rqfile
+
+
+def write_config(workdir, rqdir, rqfile, outdir, timeout, os_platform,
+                 io_per_cluster=0, io_per_role=None, clean=True,
+                 compression=False):
+    filename = os.path.join(workdir, 'config.yaml')
+    with open(filename, 'w') as f:
+        f.write('rqdir: %s\nrqfile: %s\noutdir: %s\ntimeout: %d\n'
+                'cudet_db_dir: %s\nfuelclient: False\nclean: %s\n'
+                'outputs_compression: %s\ndurations_file: %s\n' %
+                (rqdir, rqfile, outdir, timeout, synthetic.DB_DIR, clean,
+                 compression, os.path.join(workdir, 'durations.json')))
+        f.write('io_budget:\n  scripts: [packages-md5-verify-%s]\n'
+                '  per_cluster: %d\n  per_role: {%s}\n' %
+                (os_platform, io_per_cluster,
+                 ', '.join(io_per_role or [])))
+    return filename
+
+
+def replay(nm, canned, args):
+    """Points the scripts of every node at its canned outputs"""
+    rnd = random.Random(args.seed)
+    plan = {}
+    for node in nm.nodes.values():
+        latency = max(0, rnd.gauss(args.latency, args.jitter))
+        code = 1 if rnd.random() < args.failure_rate else 0
+        plan[node.id] = {'latency': latency, 'exit': code}
+        scripts = []
+        for script in node.scripts:
+            env_vars = node.env_vars + [
+                'CUDET_FAKE_LATENCY=%.3f' % latency,
+                'CUDET_FAKE_EXIT=%d' % code,
+                'CUDET_FAKE_OUTPUT=%s' % canned[node.id][script]]
+            scripts.append({script: env_vars})
+        node.scripts = scripts
+    return plan
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--nodes', type=int, default=200)
+    parser.add_argument('--envs', type=int, default=2)
+    parser.add_argument('--packages', type=int, default=1000)
+    parser.add_argument('--md5-findings', type=int, default=5)
+    parser.add_argument('--release', default='8.0')
+    parser.add_argument('--os', default='ubuntu',
+                        choices=['ubuntu', 'centos'])
+    parser.add_argument('--latency', type=float, default=0.5,
+                        help='Mean per-script latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.2,
+                        help='Standard deviation of the latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Share of nodes whose scripts exit with 1')
+    parser.add_argument('--timeout', type=int, default=600,
+                        help='Per-command timeout')
+    parser.add_argument('--maxthreads', default='auto',
+                        help="run_batch concurrency, a number or 'auto'")
+    parser.add_argument('--io-per-cluster', type=int, default=0,
+                        help=('I/O budget, md5 scripts running at the same '
+                              'time per environment'))
+    parser.add_argument('--io-per-role', action='append', default=[],
+                        metavar='ROLE=N',
+                        help=('I/O budget, md5 scripts running at the same '
+                              'time per role, can be repeated'))
+    parser.add_argument('--compression', default=False,
+                        choices=['gzip', 'zstd'],
+                        help='Compress collected outputs on disk')
+    parser.add_argument('--resume', action='store_true',
+                        help=('Collect only outputs missing or failed in '
+                              'the previous run in --workdir'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir',
+                        help='Working directory, temporary by default')
+    parser.add_argument('--output',
+                        help='Write the timings summary as JSON to this file')
+    args = parser.parse_args((argv or sys.argv)[1:])
+
+    logging.basicConfig(level=logging.ERROR)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cudet-fake-nodes-')
+    try:
+        db_files = synthetic.versions_db_files(args.release, args.os)
+        versions_dict = cudet_main.read_versions_dbs(db_files)
+        vd = versions_dict[args.release][args.os]
+        cloud = [synthetic.make_node(i + 1, i % args.envs + 1, args.release,
+                                     args.os, ip=loopback_ip(i + 1))
+                 for i in range(args.nodes)]
+        canned_dir = os.path.join(workdir, 'canned')
+        synthetic.write_outputs(canned_dir, cloud, vd,
+                                packages=args.packages,
+                                md5_findings=args.md5_findings,
+                                seed=args.seed)
+        canned = dict((n.id, n.mapscr) for n in cloud)
+        nodes_json = os.path.join(workdir, 'nodes.json')
+        write_nodes_json(nodes_json, cloud)
+        rqdir, rqfile = write_rq(workdir, args.os)
+        outdir = os.path.join(workdir, 'info')
+        config = write_config(workdir, rqdir, rqfile, outdir, args.timeout,
+                              args.os, args.io_per_cluster,
+                              [r.replace('=', ': ') for r in args.io_per_role],
+                              clean=not args.resume,
+                              compression=args.compression)
+
+        conf = configuration.get_config(argparse.Namespace(config=config))
+        release_map = dict((i + 1, args.release) for i in range(args.envs))
+        stats = timings.Timings()
+        with stats.phase('init'):
+            nm = nodes.NodeManager(conf, nodes_json=nodes_json,
+                                   release_map=release_map)
+        plan = replay(nm, canned, args)
+        started = time.time()
+        with stats.phase('run_commands'):
+            nm.run_commands(fake=False, maxthreads=args.maxthreads,
+                            resume=args.resume)
+        wall = time.time() - started
+        for node in nm.nodes.values():
+            stats.add_node(node)
+            stats.nodes[str(node.id)]['plan'] = plan[node.id]
+        codes = [c['code'] for n in nm.nodes.values()
+                 for c in getattr(n, 'timings', {}).get('commands',
+                                                        {}).values()]
+        summary = stats.summary()
+        summary['collection'] = {
+            'nodes': len(nm.nodes),
+            'maxthreads': args.maxthreads,
+            'wall': wall,
+            'nodes_per_second': len(nm.nodes) / wall if wall else None,
+            'commands': len(codes),
+            'failed': sum(1 for c in codes if c and c != 124),
+            'timed_out': sum(1 for c in codes if c == 124),
+            'resumed': sum(getattr(n, 'timings', {}).get('resumed', 0)
+                           for n in nm.nodes.values()),
+            'io_wait': sum(getattr(n, 'timings', {}).get('io_wait', 0)
+                           for n in nm.nodes.values()),
+            'concurrency': dict((k, v) for k, v in nm.concurrency.items()
+                                if k != 'adjustments')}
+        summary['concurrency'] = nm.concurrency
+        print(json.dumps(summary['collection'], indent=2, sort_keys=True))
+        phase = [p for p in summary['phases']
+                 if p['name'] == 'run_commands'][0]
+        print('children peak RSS: %s kB' % phase['children_peak_rss_kb'])
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cold start benchmark of the cudet entry point
+
+Every sample is a fresh interpreter which imports cudet.main, or runs
+`cudet --help`, and reports the time spent and which of the modules that
+are only needed on some code paths got imported. Exits with 1 if any of
+them is imported or the median time exceeds --max-ms.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules which must not be imported by the entry point itself
+LAZY_MODULES = ['cProfile', 'fuelclient', 'pkg_resources', 'urllib2',
+                'yaml']
+
+CASES = {
+    'import': 'import cudet.main',
+    'help': ('import cudet.main\n'
+             'try:\n'
+             '    cudet.main.main(["cudet", "--help"])\n'
+             'except SystemExit:\n'
+             '    pass\n'),
+}
+
+CHILD = '''
+import json, os, sys, time
+sys.path.insert(0, %(root)r)
+devnull = open(os.devnull, 'w')
+stdout, sys.stdout = sys.stdout, devnull
+started = time.time()
+%(code)s
+elapsed = time.time() - started
+sys.stdout = stdout
+print(json.dumps({'ms': elapsed * 1000,
+                  'modules': [m for m in %(lazy)r if m in sys.modules]}))
+'''
+
+
+def sample(case):
+    code = CHILD % {'root': ROOT, 'code': CASES[case], 'lazy': LAZY_MODULES}
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return json.loads(out.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Fresh interpreters per case')
+    parser.add_argument('--max-ms', type=float,
+                        help='Fail if the median time of a case exceeds this')
+    parser.add_argument('--output',
+                        help='Write the results as JSON to this file')
+    args = parser.parse_args((argv or sys.argv)[1:])
+
+    results = {}
+    failed = False
+    for case in sorted(CASES):
+        samples = [sample(case) for _ in range(args.repeat)]
+        times = sorted(s['ms'] for s in samples)
+        modules = sorted(set(m for s in samples for m in s['modules']))
+        results[case] = {'min_ms': round(times[0], 1),
+                         'median_ms': round(times[len(times) // 2], 1),
+                         'lazy_modules_imported': modules}
+        print('%-8s min %7.1f ms  median %7.1f ms%s' % (
+            case, times[0], times[len(times) // 2],
+            '  imported: ' + ', '.join(modules) if modules else ''))
+        if modules or (args.max_ms and
+                       times[len(times) // 2] > args.max_ms):
+            failed = True
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'params': vars(args),
+                       'python': platform.python_version(),
+                       'results': results}, f, indent=2, sort_keys=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmarks of the analysis path on synthetic clouds
+
+Runs without Fuel and without SSH, like `cudet --fake`: node outputs are
+generated by benchmarks.synthetic from the real versions databases.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from benchmarks import synthetic  # noqa
+from cudet import main as cudet_main  # noqa
+from cudet.vercmp import vercmp  # noqa
+
+
+def best_of(repeat, func, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.time()
+        func()
+        times.append(time.time() - started)
+    return min(times)
+
+
+def version_corpus(os_platform, size, seed=0):
+    versions = set()
+    for db_file in synthetic.versions_db_files(os_platform=os_platform):
+        db = sqlite3.connect(db_file)
+        versions.update(r[0] for r in db.execute(
+            'SELECT DISTINCT package_version FROM versions'))
+        db.close()
+    versions = sorted(versions)
+    rnd = random.Random(seed)
+    return [(rnd.choice(versions), rnd.choice(versions))
+            for _ in range(size)]
+
+
+def bench_vercmp(results, args):
+    for os_platform in ['ubuntu', 'centos']:
+        pairs = version_corpus(os_platform, args.vercmp_pairs)
+
+        def run():
+            for a, b in pairs:
+                vercmp(os_platform, a, b)
+
+        seconds = best_of(args.repeat, run)
+        results['vercmp %s' % os_platform] = {
+            'seconds': seconds,
+            'items': len(pairs),
+            'per_second': len(pairs) / seconds if seconds else None}
+
+
+def bench_versions_db(results, args):
+    db_files = synthetic.versions_db_files()
+    seconds = best_of(args.repeat,
+                      lambda: cudet_main.read_versions_dbs(db_files))
+    results['read_versions_dbs (all)'] = {'seconds': seconds,
+                                          'items': len(db_files)}
+    db_files = synthetic.versions_db_files(args.release, args.os)
+    seconds = best_of(args.repeat,
+                      lambda: cudet_main.read_versions_dbs(db_files))
+    results['read_versions_dbs (%s %s)' % (args.release, args.os)] = {
+        'seconds': seconds, 'items': len(db_files)}
+    return cudet_main.read_versions_dbs(db_files)
+
+
+def bench_analysis(results, args, versions_dict, outdir):
+    vd = versions_dict[args.release][args.os]
+    cloud = synthetic.make_nodes(args.nodes, args.release, args.os,
+                                 envs=args.envs)
+    started = time.time()
+    synthetic.write_outputs(outdir, cloud, vd, packages=args.packages,
+                            drift=args.drift, outdated=args.outdated,
+                            md5_findings=args.md5_findings)
+    results['generate outdir'] = {'seconds': time.time() - started,
+                                  'items': len(cloud)}
+    conf = {'cudet_db_dir': synthetic.DB_DIR}
+    passes = [('verify_versions', cudet_main.verify_versions,
+               {'versions_dict': versions_dict}),
+              ('verify_md5_builtin_show_results',
+               cudet_main.verify_md5_builtin_show_results, {'conf': conf}),
+              ('update_candidates', cudet_main.update_candidates,
+               {'versions_dict': versions_dict})]
+    outputs = []
+
+    def reset():
+        for node in cloud:
+            if hasattr(node, 'custom_packages'):
+                del node.custom_packages
+        del outputs[:]
+
+    def analyse():
+        for _, function, kwargs in passes:
+            for node in sorted(cloud, key=cudet_main.report_order):
+                output = {}
+                function(node=node, output=output, **kwargs)
+                outputs.append(output)
+
+    for i, (name, function, kwargs) in enumerate(passes):
+        # earlier passes fill node.custom_packages used by later ones
+        def setup(i=i):
+            reset()
+            for _, f, kw in passes[:i]:
+                for node in cloud:
+                    f(node=node, output={}, **kw)
+
+        def run(function=function, kwargs=kwargs):
+            for node in cloud:
+                function(node=node, output={}, **kwargs)
+
+        seconds = best_of(args.repeat, run, setup)
+        results['analysis %s' % name] = {'seconds': seconds,
+                                         'items': len(cloud)}
+
+    reset()
+    analyse()
+    devnull = open(os.devnull, 'w')
+
+    def render():
+        writer = cudet_main.ReportWriter(stream=devnull)
+        for output in outputs:
+            if output:
+                writer.write(output)
+
+    seconds = best_of(args.repeat, render)
+    results['pretty_print'] = {'seconds': seconds,
+                               'items': sum(1 for o in outputs if o)}
+    devnull.close()
+
+
+def print_report(results, baseline=None):
+    print('%-45s %12s %14s %8s' % ('benchmark', 'seconds', 'items/s',
+                                   'vs base'))
+    for name in sorted(results):
+        r = results[name]
+        per_second = r.get('per_second') or (
+            r['items'] / r['seconds'] if r['seconds'] else 0)
+        ratio = ''
+        if baseline and name in baseline['results']:
+            base = baseline['results'][name]['seconds']
+            if base:
+                ratio = '%.2fx' % (r['seconds'] / base)
+        print('%-45s %12.4f %14.1f %8s' % (name, r['seconds'], per_second,
+                                           ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--nodes', type=int, default=100)
+    parser.add_argument('--envs', type=int, default=2)
+    parser.add_argument('--packages', type=int, default=1000,
+                        help='Installed packages per node')
+    parser.add_argument('--drift', type=float, default=0.05,
+                        help='Share of packages in a custom version')
+    parser.add_argument('--outdated', type=float, default=0.1,
+                        help='Share of packages in a non-latest version')
+    parser.add_argument('--md5-findings', type=int, default=5,
+                        help='md5 mismatches per node')
+    parser.add_argument('--release', default='8.0')
+    parser.add_argument('--os', default='ubuntu',
+                        choices=['ubuntu', 'centos'])
+    parser.add_argument('--vercmp-pairs', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Report the best of this many runs')
+    parser.add_argument('--outdir',
+                        help=('Where to generate node outputs, a temporary '
+                              'directory by default'))
+    parser.add_argument('--output',
+                        help='Write the report as JSON to this file')
+    parser.add_argument('--compare',
+                        help='JSON report of a previous run to compare with')
+    args = parser.parse_args((argv or sys.argv)[1:])
+
+    # the real databases contain known downgrades, don't flood the report
+    logging.disable(logging.WARNING)
+    outdir = args.outdir or tempfile.mkdtemp(prefix='cudet-bench-')
+    results = {}
+    try:
+        bench_vercmp(results, args)
+        versions_dict = bench_versions_db(results, args)
+        bench_analysis(results, args, versions_dict, outdir)
+    finally:
+        if not args.outdir:
+            shutil.rmtree(outdir, ignore_errors=True)
+
+    report = {'params': dict((k, v) for k, v in vars(args).items()
+                             if k not in ('output', 'compare', 'outdir')),
+              'python': platform.python_version(),
+              'results': results}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
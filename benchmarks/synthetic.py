@@ -0,0 +1,112 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Synthetic clouds - nodes and collected outputs in the layout of
+Node.exec_cmd, generated from a real versions database
+"""
+
+import glob
+import os
+import random
+
+from cudet import nodes
+from cudet import utils
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_DIR = os.path.join(ROOT, 'db')
+ROLES = [['controller'], ['compute'], ['compute', 'cinder'], ['mongo']]
+
+
+def versions_db_files(release=None, os_platform=None):
+    """Returns real versions database files, optionally filtered"""
+    files = sorted(glob.glob(os.path.join(DB_DIR, 'versions', '*',
+                                          '*.sqlite')))
+    if release:
+        files = [f for f in files
+                 if os.path.basename(os.path.dirname(f)) == release]
+    if os_platform:
+        files = [f for f in files
+                 if os.path.basename(f).endswith('%s.sqlite' % os_platform)]
+    return files
+
+
+def make_node(node_id, cluster, release, os_platform, roles=None, ip=None):
+    return nodes.Node(id=node_id,
+                      name='node-%s' % node_id,
+                      fqdn='node-%s.domain.tld' % node_id,
+                      mac='00:00:00:00:%02x:%02x' % (node_id // 256,
+                                                     node_id % 256),
+                      cluster=cluster,
+                      release=release,
+                      roles=roles or ROLES[node_id % len(ROLES)],
+                      os_platform=os_platform,
+                      online=True,
+                      status='ready',
+                      ip=ip or '10.20.%d.%d' % (node_id // 250,
+                                                node_id % 250 + 2),
+                      conf={})
+
+
+def make_nodes(count, release, os_platform, envs=1):
+    return [make_node(i + 1, i % envs + 1, release, os_platform)
+            for i in range(count)]
+
+
+def output_file(outdir, node, script):
+    """Path of a script output, same layout as Node.exec_cmd"""
+    return os.path.join(outdir, nodes.Node.ckey,
+                        'cluster-%s' % node.cluster,
+                        'node-%s' % node.id,
+                        'node-%s-%s-%s' % (node.id, node.ip, script))
+
+
+def write_outputs(outdir, cloud_nodes, vd, packages=1000, drift=0.05,
+                  outdated=0.1, md5_findings=5, seed=0):
+    """Writes packagelist and md5 verification outputs for every node
+
+    :param vd: versions_dict[release][os_platform] from read_versions_dbs
+    :param packages: number of installed packages per node
+    :param drift: share of packages with a version unknown to the db
+    :param outdated: share of packages installed in a non-latest version
+    :param md5_findings: md5 mismatches reported per node
+    """
+    rnd = random.Random(seed)
+    names = sorted(vd)
+    for node in cloud_nodes:
+        installed = []
+        for p_name in rnd.sample(names, min(packages, len(names))):
+            p_version = vd[p_name]['max_version']
+            older = [v for v in vd[p_name]['versions'] if v != p_version]
+            x = rnd.random()
+            if x < drift:
+                p_version += '+custom1'
+            elif x < drift + outdated and older:
+                p_version = rnd.choice(sorted(older))
+            installed.append((p_name, p_version))
+        installed.sort()
+        packagelist = 'packagelist-%s' % node.os_platform
+        md5_verify = 'packages-md5-verify-%s' % node.os_platform
+        node.mapscr = {packagelist: output_file(outdir, node, packagelist),
+                       md5_verify: output_file(outdir, node, md5_verify)}
+        utils.mdir(os.path.dirname(node.mapscr[packagelist]))
+        with open(node.mapscr[packagelist], 'w') as f:
+            for p_name, p_version in installed:
+                f.write('%s\t%s\n' % (p_name, p_version))
+        with open(node.mapscr[md5_verify], 'w') as f:
+            for i in range(md5_findings):
+                p_name, p_version = rnd.choice(installed)
+                f.write('%s\t%s\t??5?????? /usr/lib/%s/file%d\n' %
+                        (p_name, p_version, p_name, i))
@@ -0,0 +1,128 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Server-side md5 verification against a baseline database
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+
+from cudet import utils
+
+
+logger = logging.getLogger(__name__)
+
+
+class Md5Baseline(object):
+    """Compares md5 sums collected from nodes with the md5 baseline
+
+    The baseline for a release/os pair is built once from the versions
+    database and the md5 database (see util/build-md5-db.py) into an
+    in-memory table indexed by (package, version, path). A node output is
+    bulk-loaded and compared in a single join; results are cached by the
+    digest of the output, so nodes with identical content are compared once.
+    """
+
+    def __init__(self, db_dir):
+        self.db_dir = db_dir
+        self.dbs = {}
+        self.cache = {}
+
+    def _files(self, release, os_platform):
+        return (os.path.join(self.db_dir, 'versions', release,
+                             '%s.sqlite' % os_platform),
+                os.path.join(self.db_dir, 'md5', release,
+                             '%s.sqlite' % os_platform))
+
+    def available(self, release, os_platform):
+        return all(os.path.isfile(f)
+                   for f in self._files(str(release), str(os_platform)))
+
+    def _connect(self, release, os_platform):
+        key = (release, os_platform)
+        if key not in self.dbs:
+            versions_file, md5_file = self._files(release, os_platform)
+            logger.debug('loading md5 baseline from %s' % md5_file)
+            db = sqlite3.connect(':memory:')
+            db.text_factory = str
+            db.execute('ATTACH DATABASE ? AS v', (versions_file,))
+            db.execute('ATTACH DATABASE ? AS m', (md5_file,))
+            db.execute('''
+                CREATE TABLE baseline AS
+                SELECT DISTINCT
+                    versions.package_name AS package,
+                    versions.package_version AS version,
+                    md5.path AS path,
+                    md5.md5 AS md5
+                FROM v.versions AS versions
+                JOIN m.md5 AS md5 ON md5.version_id = versions.id
+                WHERE versions.os = ?
+                ''', (os_platform,))
+            db.execute('''
+                CREATE INDEX baseline_idx
+                ON baseline (package, version, path)''')
+            db.commit()
+            db.execute('DETACH DATABASE v')
+            db.execute('DETACH DATABASE m')
+            self.dbs[key] = db
+        return self.dbs[key]
+
+    def compare(self, release, os_platform, filename):
+        """Returns md5 deviations found in a node output
+
+        :param filename: output of packages-md5-list-<os> script, lines of
+                         "package<TAB>version<TAB>path<TAB>md5", possibly
+                         compressed
+        :returns: sorted list of (package, version, path) tuples for files
+                  which are known to the baseline but have a different md5
+        """
+        release = str(release)
+        os_platform = str(os_platform)
+        with utils.open_output(filename) as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+        key = (release, os_platform, digest)
+        if key in self.cache:
+            return self.cache[key]
+        db = self._connect(release, os_platform)
+        db.execute('''
+            CREATE TEMP TABLE node_md5
+            (
+                package TEXT,
+                version TEXT,
+                path TEXT,
+                md5 TEXT
+            )''')
+        try:
+            with utils.open_output(filename) as f:
+                rows = (line.rstrip('\n').split('\t') for line in f)
+                db.executemany('INSERT INTO node_md5 VALUES (?,?,?,?)',
+                               (row for row in rows if len(row) == 4))
+            result = db.execute('''
+                SELECT n.package, n.version, n.path
+                FROM node_md5 AS n
+                JOIN baseline AS b
+                    ON b.package = n.package
+                    AND b.version = n.version
+                    AND b.path = n.path
+                GROUP BY n.rowid
+                HAVING SUM(b.md5 = n.md5) = 0
+                ORDER BY n.package, n.version, n.path
+                ''').fetchall()
+        finally:
+            db.execute('DROP TABLE node_md5')
+        self.cache[key] = result
+        return result
@@ -12,7 +12,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import pkg_resources
+import os
 
 from cudet import utils
 
@@ -35,9 +35,15 @@ class CudetConfig(object):
             self._update_config_by_args(args)
 
     def _init_default_config(self):
-        default_config_file = pkg_resources.resource_filename(
-            'cudet',
-            DEFAULT_CONFIG_FILE)
+        # next to this module, pkg_resources takes long to import and is
+        # only needed if the package is not installed as plain files
+        default_config_file = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), DEFAULT_CONFIG_FILE)
+        if not os.path.isfile(default_config_file):
+            import pkg_resources
+            default_config_file = pkg_resources.resource_filename(
+                'cudet',
+                DEFAULT_CONFIG_FILE)
         self.config = utils.load_yaml_file(default_config_file)
 
     def _update_config_by_args(self, args):
@@ -56,6 +62,13 @@ class CudetConfig(object):
         if node_ids is not None:
             self.config['filters']['id'] = node_ids
 
+        if getattr(args, 'md5_baseline', False):
+            self.config['md5_baseline'] = True
+
+        if getattr(args, 'resume', False):
+            # outputs of the interrupted run are needed
+            self.config['clean'] = False
+
     def _update_by_config_file(self, config_file):
         additional_config = utils.load_yaml_file(config_file)
         self.config.update(additional_config)
@@ -29,3 +29,11 @@ class AllNodesFiltered(CudetBaseException):
     Indicates that there are no nodes which have been passed filtration
     """
     pass
+
+
+class LockUnavailable(CudetBaseException):
+    """
+    Indicates that a lock is not accessible or was not released by another
+    process in time
+    """
+    pass
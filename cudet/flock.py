@@ -22,6 +22,10 @@
 import errno
 import fcntl
 import os
+import time
+
+# seconds between attempts of FLock.lock with wait
+POLL_INTERVAL = 0.5
 
 
 class FLock:
@@ -44,13 +48,23 @@ class FLock:
         self.lockfile = lockfile
         self.lockfd = None
 
-    def lock(self):
+    def lock(self, wait=0):
         '''
         Creates and holds on to the lock file with exclusive access.
         Returns True if lock successful, False if it is not, and raises
         an exception upon operating system errors encountered creating the
-        lock file.
+        lock file. With wait (seconds) the lock is retried until it is
+        released by its holder or the time is up.
         '''
+        deadline = time.time() + wait
+        while not self._try_lock():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(POLL_INTERVAL, remaining))
+        return True
+
+    def _try_lock(self):
         try:
             #
             # Create or else open and trucate lock file, in read-write mode.
@@ -69,6 +83,13 @@ class FLock:
             # but don't block waiting for it
             fcntl.flock(self.lockfd, fcntl.LOCK_EX | fcntl.LOCK_NB)
 
+            # The previous holder unlinks the file on unlock, a lock on
+            # the unlinked file would not exclude processes locking the
+            # next file at the same path
+            if not self._is_current():
+                self._close()
+                return False
+
             # Writing to file is pointless, nobody can see it
             os.write(self.lockfd, "lockfile")
 
@@ -77,17 +98,30 @@ class FLock:
             # Lock cannot be acquired is okay,
             # everything else reraise exception
             if e.errno in (errno.EACCES, errno.EAGAIN):
+                self._close()
                 return False
             else:
                 raise
 
+    def _close(self):
+        if self.lockfd is not None:
+            os.close(self.lockfd)
+            self.lockfd = None
+
+    def _is_current(self):
+        try:
+            return (os.stat(self.lockfile).st_ino ==
+                    os.fstat(self.lockfd).st_ino)
+        except OSError:
+            return False
+
     def unlock(self):
         try:
             # FIRST unlink file, then close it.  This way, we avoid file
             # existence in an unlocked state
             os.unlink(self.lockfile)
             # Just in case, let's not leak file descriptors
-            os.close(self.lockfd)
+            self._close()
         except (OSError, IOError):
             # Ignore error destroying lock file.  See class doc about how
             # lockfile can be erased and everything still works normally.
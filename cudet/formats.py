@@ -0,0 +1,173 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Machine-readable output formats for the analysis results
+"""
+
+import csv
+import json
+import os
+import sqlite3
+import sys
+
+
+FIELDS = ['env', 'node', 'roles', 'check', 'package', 'version', 'message']
+FORMATS = ['yaml', 'jsonl', 'csv', 'sqlite']
+
+
+def _message_records(message, key=None):
+    """Yields (package, version, message) for a single output_add message"""
+    if key is not None:
+        # keyed messages (md5 verification) - key is "package version"
+        parts = str(key).split(' ', 1)
+        yield parts[0], parts[1] if len(parts) > 1 else None, message
+    elif type(message) is dict:
+        # {package: message}, package can be prefixed with its state, for
+        # example "custom [version] package"
+        for k, v in message.items():
+            package = str(k).split(' ')[-1]
+            state = str(k)[:-len(package)].strip()
+            yield package, None, '%s %s' % (state, v) if state else v
+    else:
+        yield None, None, message
+
+
+def _node_records(output):
+    if type(output) is list:
+        for message in output:
+            for record in _message_records(message):
+                yield record
+    else:
+        for key, messages in output.items():
+            for message in messages:
+                for record in _message_records(message, key):
+                    yield record
+
+
+def output_records(output, check):
+    """Flattens a dict built by main.output_add into one record per finding
+
+    :param check: name of the check which produced the output
+    :returns: generator of dicts with FIELDS keys
+    """
+    for e_id, env in output.items():
+        if e_id == 'fuel':
+            nodes = {0: {'roles': ['fuel'], 'output': env}}
+            e_id = 0
+        else:
+            nodes = env
+        for n_id, node in nodes.items():
+            for package, version, message in _node_records(node['output']):
+                yield {'env': e_id,
+                       'node': n_id,
+                       'roles': ', '.join(node['roles']),
+                       'check': check,
+                       'package': package,
+                       'version': version,
+                       'message': message}
+
+
+class JsonlWriter(object):
+    """Writes one JSON document per finding and line"""
+
+    def __init__(self, stream, close_stream=False):
+        self.stream = stream
+        self.close_stream = close_stream
+
+    def write(self, output, check):
+        for record in output_records(output, check):
+            self.stream.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def close(self):
+        self.stream.flush()
+        if self.close_stream:
+            self.stream.close()
+
+
+class CsvWriter(object):
+    """Writes one CSV row per finding, with a header row"""
+
+    def __init__(self, stream, close_stream=False):
+        self.stream = stream
+        self.close_stream = close_stream
+        self.writer = csv.writer(stream)
+        self.writer.writerow(FIELDS)
+
+    def write(self, output, check):
+        for record in output_records(output, check):
+            self.writer.writerow([record[f] for f in FIELDS])
+
+    def close(self):
+        self.stream.flush()
+        if self.close_stream:
+            self.stream.close()
+
+
+class SqliteWriter(object):
+    """Writes findings into a "findings" table of a new sqlite database,
+    indexed by node, package and check"""
+
+    def __init__(self, filename):
+        if os.path.exists(filename):
+            os.remove(filename)
+        self.db = sqlite3.connect(filename)
+        self.db.text_factory = str
+        self.db.execute('''
+            CREATE TABLE findings
+            (
+                env INTEGER,
+                node INTEGER,
+                roles TEXT,
+                "check" TEXT,
+                package TEXT,
+                version TEXT,
+                message TEXT
+            )''')
+        for column in ['node', 'package', 'check']:
+            self.db.execute('CREATE INDEX findings_%s ON findings ("%s")' %
+                            (column, column))
+
+    def write(self, output, check):
+        self.db.executemany(
+            'INSERT INTO findings VALUES (?,?,?,?,?,?,?)',
+            ([r[f] for f in FIELDS] for r in output_records(output, check)))
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def get_writer(fmt, filename=None, stream=None):
+    """Returns a writer for the format, None for the default (yaml) report
+
+    :param filename: output file, mandatory for sqlite
+    :param stream: stream used if filename is omitted, stdout by default
+    """
+    if fmt in (None, 'yaml'):
+        return None
+    if fmt == 'sqlite':
+        if not filename:
+            raise ValueError('sqlite format requires an output file')
+        return SqliteWriter(filename)
+    if fmt not in FORMATS:
+        raise ValueError('unknown output format %s' % fmt)
+    if filename:
+        stream = open(filename, 'w')
+    if fmt == 'jsonl':
+        return JsonlWriter(stream or sys.stdout, close_stream=bool(filename))
+    if fmt == 'csv':
+        return CsvWriter(stream or sys.stdout, close_stream=bool(filename))
+    raise ValueError('unknown output format %s' % fmt)
@@ -20,28 +20,31 @@ Working with fuel client as a library
 
 import logging
 
-try:
-    from fuelclient.client import Client as FuelClient
-except ImportError:
+from cudet import utils
+
+
+logger = logging.getLogger(__name__)
+
+
+def _import_client():
+    """Imports the Fuel client class, only when a client is needed since
+    fuelclient takes long to import"""
     try:
-        from fuelclient.client import APIClient as FuelClient
+        from fuelclient.client import Client as FuelClient
     except ImportError:
-        FuelClient = None
-
-if FuelClient is not None:
-    from fuelclient import fuelclient_settings
+        try:
+            from fuelclient.client import APIClient as FuelClient
+        except ImportError:
+            return None
 
     # LP bug 1592445
     try:
-        from fuelclient.client import logger
-        logger.handlers = []
+        from fuelclient.client import logger as fuelclient_logger
+        fuelclient_logger.handlers = []
     except:
         pass
 
-from cudet import utils
-
-
-logger = logging.getLogger(__name__)
+    return FuelClient
 
 
 def get_client(config):
@@ -53,6 +56,7 @@ def get_client(config):
 
     client = None
 
+    FuelClient = _import_client()
     if FuelClient is not None:
         with utils.environ_settings(http_proxy=config.fuel_http_proxy,
                                     HTTP_PROXY=config.fuel_http_proxy):
@@ -67,6 +71,7 @@ def get_client(config):
                                         os_tenant_name=config.fuel_tenant)
                 except TypeError:
                     # instantiate fuel client using old init signature
+                    from fuelclient import fuelclient_settings
                     fuel_settings = fuelclient_settings.get_settings()
                     fuel_config = fuel_settings.config
                     fuel_config['OS_USERNAME'] = config.fuel_user
@@ -0,0 +1,137 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Historical store of analysis results
+"""
+
+import datetime
+import os
+import sqlite3
+
+from cudet import formats
+from cudet import utils
+
+
+# columns identifying a finding across runs
+KEY = ['env', 'node', 'roles', 'check', 'package', 'version', 'message']
+
+
+def _now():
+    return datetime.datetime.now().strftime('%F %H:%M:%S')
+
+
+class History(object):
+    """Persists findings of every run for run-to-run diffs
+
+    Each run gets a row in "runs", the list of analysed nodes goes to
+    "run_nodes" and every finding to "findings", indexed by run so that a
+    diff of two runs is a pair of indexed EXCEPT queries.
+    """
+
+    def __init__(self, filename):
+        utils.mdir(os.path.dirname(filename) or '.')
+        self.db = sqlite3.connect(filename)
+        self.db.text_factory = str
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS runs
+            (
+                id INTEGER PRIMARY KEY,
+                started TEXT,
+                finished TEXT,
+                fake INTEGER
+            )''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS run_nodes
+            (
+                run_id INTEGER,
+                env INTEGER,
+                node INTEGER
+            )''')
+        self.db.execute('''
+            CREATE INDEX IF NOT EXISTS run_nodes_run_id
+            ON run_nodes (run_id, node)''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS findings
+            (
+                run_id INTEGER,
+                env INTEGER,
+                node INTEGER,
+                roles TEXT,
+                "check" TEXT,
+                package TEXT,
+                version TEXT,
+                message TEXT
+            )''')
+        self.db.execute('''
+            CREATE INDEX IF NOT EXISTS findings_run_id
+            ON findings (run_id, node, "check", package)''')
+        self.db.commit()
+        self.run_id = None
+
+    def start_run(self, nodes, fake=False):
+        cur = self.db.execute('INSERT INTO runs (started, fake) VALUES (?,?)',
+                              (_now(), int(bool(fake))))
+        self.run_id = cur.lastrowid
+        self.db.executemany(
+            'INSERT INTO run_nodes (run_id, env, node) VALUES (?,?,?)',
+            [(self.run_id, n.cluster, n.id) for n in nodes])
+        self.db.commit()
+        return self.run_id
+
+    def write(self, output, check):
+        self.db.executemany(
+            'INSERT INTO findings VALUES (?,?,?,?,?,?,?,?)',
+            ([self.run_id] + [r[f] for f in formats.FIELDS]
+             for r in formats.output_records(output, check)))
+        self.db.commit()
+
+    def finish_run(self):
+        self.db.execute('UPDATE runs SET finished = ? WHERE id = ?',
+                        (_now(), self.run_id))
+        self.db.commit()
+
+    def runs(self, finished=True):
+        """Returns [(id, started, finished, fake), ...], oldest first"""
+        query = 'SELECT id, started, finished, fake FROM runs'
+        if finished:
+            query += ' WHERE finished IS NOT NULL'
+        return self.db.execute(query + ' ORDER BY id').fetchall()
+
+    def diff(self, old_run, new_run):
+        """Returns (new, resolved) lists of finding dicts
+
+        Findings of nodes which were not analysed in new_run are not
+        reported as resolved.
+        """
+        columns = ', '.join('"%s"' % c for c in KEY)
+        new = self.db.execute('''
+            SELECT %(c)s FROM findings WHERE run_id = :new
+            EXCEPT
+            SELECT %(c)s FROM findings WHERE run_id = :old
+            ORDER BY env, node
+            ''' % {'c': columns}, {'old': old_run, 'new': new_run}).fetchall()
+        resolved = self.db.execute('''
+            SELECT %(c)s FROM findings
+            WHERE run_id = :old
+                AND node IN (SELECT node FROM run_nodes WHERE run_id = :new)
+            EXCEPT
+            SELECT %(c)s FROM findings WHERE run_id = :new
+            ORDER BY env, node
+            ''' % {'c': columns}, {'old': old_run, 'new': new_run}).fetchall()
+        return ([dict(zip(KEY, r)) for r in new],
+                [dict(zip(KEY, r)) for r in resolved])
+
+    def close(self):
+        self.db.close()
@@ -23,11 +23,14 @@ import os
 import re
 import sqlite3
 import sys
-import urllib2
-import yaml
 
+from cudet import baseline
 from cudet import configuration
+from cudet import formats
+from cudet import history
 from cudet import nodes
+from cudet import timings
+from cudet import utils
 from cudet.utils import interrupt_wrapper
 from cudet.vercmp import vercmp
 
@@ -47,8 +50,70 @@ class Unbuffered(object):
         return getattr(self.stream, attr)
 
 
+def read_versions_dbs(db_files):
+    versions_dict = {}
+    for db_file in db_files:
+        import_db = sqlite3.connect(db_file)
+        import_dbc = import_db.cursor()
+        r = import_dbc.execute('''
+            SELECT
+                id,
+                job_id,
+                release,
+                mu,
+                os,
+                package_name,
+                package_version,
+                package_filename
+            FROM versions
+            ORDER BY package_name ASC, mu DESC
+            ''')
+        for row in r.fetchall():
+            release = row[2]
+            mu = row[3]
+            os_platform = row[4]
+            p_name = row[5]
+            p_version = row[6]
+            if release not in versions_dict:
+                versions_dict[release] = {}
+            vdr = versions_dict[release]
+            if os_platform not in vdr:
+                vdr[os_platform] = {}
+            if p_name not in vdr[os_platform]:
+                vdr[os_platform][p_name] = {}
+            p_dict = vdr[os_platform][p_name]
+            if 'mu' not in p_dict:
+                p_dict['mu'] = set()
+            p_dict['mu'].add(mu)
+            if 'versions' not in p_dict:
+                p_dict['versions'] = {}
+            if p_version not in p_dict['versions']:
+                p_dict['versions'][p_version] = set()
+            if 'max_version' not in p_dict:
+                p_dict['max_version'] = p_version
+            else:
+                r = vercmp(os_platform, p_version, p_dict['max_version'])
+                max_v_mus = p_dict['versions'][p_dict['max_version']]
+                if r > 0 and mu not in max_v_mus:
+                    '''Should never happen since the MU order is DESC.
+                    If this happens then it means that package version was
+                    lowered in a subsequent MU, which is against our policy as
+                    of Feb 2016.'''
+                    logging.warning('Downgrade detected in release '
+                                    '%s, os %s, %s to %s, package %s - '
+                                    "version '%s' was downgraded to '%s'\n"
+                                    % (release, os_platform, print_mu(mu),
+                                       print_mu(min(max_v_mus)), p_name,
+                                       p_version, p_dict['max_version']))
+                elif r > 0:
+                    p_dict['max_version'] = p_version
+            p_dict['versions'][p_version].add(mu)
+    return versions_dict
+
+
 def load_versions_dict(conf, nm):
     def fetch(url):
+        import urllib2
         try:
             return urllib2.urlopen(url).read()
         except:
@@ -133,68 +198,12 @@ def load_versions_dict(conf, nm):
                 else:
                     for n in dbs[r][p]['nodes']:
                         output_add(output, n, msg_nodb_fail % (r, p))
-    versions_dict = {}
-    for db_file in db_files:
-        import_db = sqlite3.connect(db_file)
-        import_dbc = import_db.cursor()
-        r = import_dbc.execute('''
-            SELECT
-                id,
-                job_id,
-                release,
-                mu,
-                os,
-                package_name,
-                package_version,
-                package_filename
-            FROM versions
-            ORDER BY package_name ASC, mu DESC
-            ''')
-        for row in r.fetchall():
-            release = row[2]
-            mu = row[3]
-            os_platform = row[4]
-            p_name = row[5]
-            p_version = row[6]
-            if release not in versions_dict:
-                versions_dict[release] = {}
-            vdr = versions_dict[release]
-            if os_platform not in vdr:
-                vdr[os_platform] = {}
-            if p_name not in vdr[os_platform]:
-                vdr[os_platform][p_name] = {}
-            p_dict = vdr[os_platform][p_name]
-            if 'mu' not in p_dict:
-                p_dict['mu'] = set()
-            p_dict['mu'].add(mu)
-            if 'versions' not in p_dict:
-                p_dict['versions'] = {}
-            if p_version not in p_dict['versions']:
-                p_dict['versions'][p_version] = set()
-            if 'max_version' not in p_dict:
-                p_dict['max_version'] = p_version
-            else:
-                r = vercmp(os_platform, p_version, p_dict['max_version'])
-                max_v_mus = p_dict['versions'][p_dict['max_version']]
-                if r > 0 and mu not in max_v_mus:
-                    '''Should never happen since the MU order is DESC.
-                    If this happens then it means that package version was
-                    lowered in a subsequent MU, which is against our policy as
-                    of Feb 2016.'''
-                    logging.warning('Downgrade detected in release '
-                                    '%s, os %s, %s to %s, package %s - '
-                                    "version '%s' was downgraded to '%s'\n"
-                                    % (release, os_platform, print_mu(mu),
-                                       print_mu(min(max_v_mus)), p_name,
-                                       p_version, p_dict['max_version']))
-                elif r > 0:
-                    p_dict['max_version'] = p_version
-            p_dict['versions'][p_version].add(mu)
+    versions_dict = read_versions_dbs(db_files)
     return versions_dict, output
 
 
-def node_manager_init(conf):
-    return nodes.NodeManager(conf=conf)
+def node_manager_init(conf, fake=False):
+    return nodes.NodeManager(conf=conf, fake=fake)
 
 
 def output_add(output, node, message, key=None):
@@ -231,31 +240,80 @@ def output_add(output, node, message, key=None):
     return output
 
 
-def output_prepare(output):
-    for e_id, env in output.items():
-        if e_id == 'fuel':
-            if type(env) is list:
-                env.sort()
+def env_str(e_id):
+    # the fuel node has cluster 0 and its output is stored under 'fuel'
+    return 'fuel' if e_id in (0, 'fuel') else 'env %s' % (str(e_id),)
+
+
+def node_str(n_id, roles):
+    return 'node %s [%s]' % (str(n_id), ', '.join(roles))
+
+
+def report_order(node):
+    return (env_str(node.cluster), node_str(node.id, node.roles))
+
+
+class ReportWriter(object):
+    """Writes report sections as soon as they are ready
+
+    Env and node headers are written directly and only the findings of one
+    node at a time are rendered by the YAML dumper (libyaml's if available),
+    so memory use is bounded by the largest node section. Sections have to
+    be written in report_order to produce a valid document.
+    """
+
+    def __init__(self, stream=None, pre_indent=4):
+        # not needed by --help and other report formats
+        import yaml
+        self.yaml = yaml
+        self.Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+        self.stream = stream or sys.stdout
+        self.pre_indent = pre_indent
+        self.started = False
+        self.env = None
+
+    def _write_line(self, indent, line):
+        self.stream.write(' ' * (self.pre_indent + indent) + line + '\n')
+
+    def _write_list(self, indent, items):
+        text = self.yaml.dump(items, Dumper=self.Dumper,
+                              default_flow_style=False)
+        for line in text.splitlines():
+            self._write_line(indent, line)
+
+    def _write_output(self, indent, output):
+        # block sequences are indented under their key
+        if type(output) is list:
+            output.sort()
+            self._write_list(indent + 2, output)
         else:
-            env_str = 'env %s' % (str(e_id),)
-            output[env_str] = output.pop(e_id)
-            for n_id, node in env.items():
-                if type(node['output']) is list:
-                    node['output'].sort()
-                node_str = 'node %s [%s]' % (str(n_id),
-                                             ', '.join(node['roles']))
-                env[node_str] = env.pop(n_id)['output']
+            for key in sorted(output):
+                self._write_line(indent + 2, '%s:' % key)
+                self._write_list(indent + 4, output[key])
+
+    def write(self, output):
+        """Writes a dict built by output_add"""
+        if not self.started:
+            self.stream.write('\n')
+            self.started = True
+        for e_id in sorted(output, key=env_str):
+            env = env_str(e_id)
+            if env != self.env:
+                self._write_line(0, '%s:' % env)
+                self.env = env
+            if env == 'fuel':
+                self._write_output(0, output[e_id])
+                continue
+            nodes = output[e_id]
+            for n_id in sorted(nodes,
+                               key=lambda n: node_str(n, nodes[n]['roles'])):
+                self._write_line(2, '%s:' % node_str(n_id,
+                                                     nodes[n_id]['roles']))
+                self._write_output(2, nodes[n_id]['output'])
 
 
 def pretty_print(output, pre_indent=4):
-    sys.stdout.write('\n')
-    output_prepare(output)
-    for line in yaml.safe_dump(output, default_flow_style=False).split('\n'):
-        if len(line) > 0:
-            if re.match('^ *-', line):
-                # force ident for block sequences
-                line = '  ' + line
-            print(' ' * pre_indent + line)
+    ReportWriter(pre_indent=pre_indent).write(output)
 
 
 def fstrip(text_file):
@@ -276,10 +334,10 @@ def verify_versions(node, versions_dict, output=None):
         return output_add(output, node, 'versions data was not collected!')
     if not os.path.exists(node.mapscr[command]):
         return output_add(output, node, 'versions data output file missing!')
-    if os.stat(node.mapscr[command]).st_size == 0:
+    if utils.output_empty(node.mapscr[command]):
         return output_add(output, node,
                           'versions data empty, you may want to re-run!')
-    with open(node.mapscr[command], 'r') as packagelist:
+    with utils.open_output(node.mapscr[command]) as packagelist:
         reader = csv.reader(packagelist, delimiter='\t')
         if not hasattr(node, 'custom_packages'):
             node.custom_packages = {}
@@ -300,46 +358,87 @@ def verify_versions(node, versions_dict, output=None):
     return output
 
 
-def verify_md5_builtin_show_results(conf, node, output=None):
-    command = 'packages-md5-verify-'+node.os_platform
-    if command not in node.mapscr:
-        return output_add(output, node, 'builtin md5 data was not collected!')
-    if not os.path.exists(node.mapscr[command]):
-        return output_add(output, node,
-                          'builtin md5 data output file missing!')
+def load_md5_filters(conf, node):
     ex_filename = os.path.join(conf['cudet_db_dir'],
                                'md5/%s/%s.filter' % (node.release,
                                                      node.os_platform))
-    # value-less dict
     ex_list = []
     if os.path.isfile(ex_filename):
         with open(ex_filename, 'r') as ex_file:
             for line in fstrip(ex_file):
                 ex_list.append(line)
-    if os.stat(node.mapscr[command]).st_size > 0:
-        with open(node.mapscr[command], 'r') as md5_file:
+    return ex_list
+
+
+def md5_excluded(ex_list, line):
+    for ex_regexp in ex_list:
+        if re.match(ex_regexp, line):
+            return True
+    return False
+
+
+def add_md5_custom_package(node, p_name, p_version, reason):
+    if not hasattr(node, 'custom_packages'):
+        node.custom_packages = {}
+    if p_name not in node.custom_packages:
+        node.custom_packages[p_name] = {}
+        node.custom_packages[p_name]['reasons'] = set()
+    node.custom_packages[p_name]['version'] = p_version
+    node.custom_packages[p_name]['reasons'].add(reason)
+
+
+def verify_md5_builtin_show_results(conf, node, output=None):
+    command = 'packages-md5-verify-'+node.os_platform
+    if command not in node.mapscr:
+        return output_add(output, node, 'builtin md5 data was not collected!')
+    if not os.path.exists(node.mapscr[command]):
+        return output_add(output, node,
+                          'builtin md5 data output file missing!')
+    ex_list = load_md5_filters(conf, node)
+    if not utils.output_empty(node.mapscr[command]):
+        with utils.open_output(node.mapscr[command]) as md5_file:
             for line in fstrip(md5_file):
-                excluded = False
-                for ex_regexp in ex_list:
-                    if re.match(ex_regexp, line):
-                        excluded = True
-                        break
-                if excluded:
+                if md5_excluded(ex_list, line):
                     continue
                 p_name, p_version, details = line.split('\t')
-                if not hasattr(node, 'custom_packages'):
-                    node.custom_packages = {}
-                if p_name not in node.custom_packages:
-                    node.custom_packages[p_name] = {}
-                    node.custom_packages[p_name]['reasons'] = set()
-                node.custom_packages[p_name]['version'] = p_version
-                node.custom_packages[p_name]['reasons'].add('builtin-md5')
+                add_md5_custom_package(node, p_name, p_version, 'builtin-md5')
                 output_add(output, node,
                            str(details).strip(),
                            '%s %s' % (str(p_name), str(p_version)))
     return output
 
 
+def use_md5_baseline(nm):
+    '''Replaces packages-md5-verify-* scripts with packages-md5-list-*,
+    which only collect md5 sums - verification is done on the master.'''
+    for node in nm.nodes.values():
+        node.scripts = [s.replace('packages-md5-verify-',
+                                  'packages-md5-list-')
+                        if type(s) is not dict else s for s in node.scripts]
+
+
+def verify_md5_baseline_show_results(conf, node, md5_baseline, output=None):
+    command = 'packages-md5-list-'+node.os_platform
+    if command not in node.mapscr:
+        return output_add(output, node, 'md5 data was not collected!')
+    if not os.path.exists(node.mapscr[command]):
+        return output_add(output, node, 'md5 data output file missing!')
+    if not md5_baseline.available(node.release, node.os_platform):
+        return output_add(output, node,
+                          ('the md5 baseline database does not have any '
+                           'data for MOS release %s for %s!' %
+                           (str(node.release), str(node.os_platform))))
+    ex_list = load_md5_filters(conf, node)
+    for p_name, p_version, path in md5_baseline.compare(
+            node.release, node.os_platform, node.mapscr[command]):
+        if md5_excluded(ex_list, '%s\t%s\t%s' % (p_name, p_version, path)):
+            continue
+        add_md5_custom_package(node, p_name, p_version, 'baseline-md5')
+        output_add(output, node, str(path),
+                   '%s %s' % (str(p_name), str(p_version)))
+    return output
+
+
 def print_mu(mu):
     return 'MU'+str(mu) if mu > 0 else 'GA'
 
@@ -406,10 +505,10 @@ def update_candidates(node, versions_dict, output=None):
         return output_add(output, node, 'versions data was not collected!')
     if not os.path.exists(node.mapscr[command]):
         return output_add(output, node, 'versions data output file missing!')
-    if os.stat(node.mapscr[command]).st_size == 0:
+    if utils.output_empty(node.mapscr[command]):
         return output_add(output, node,
                           'versions data empty, you may want to re-run!')
-    with open(node.mapscr[command], 'r') as packagelist:
+    with utils.open_output(node.mapscr[command]) as packagelist:
         reader = csv.reader(packagelist, delimiter='\t')
         for p_name, p_version in reader:
             if p_name in vd:
@@ -442,19 +541,103 @@ def update_candidates(node, versions_dict, output=None):
     return output
 
 
-def perform(description, function, nm, args, ok_message):
+def perform(description, function, nm, args, ok_message, check=None,
+            writer=None, store=None):
     sys.stdout.write(description+': ')
-    output = {}
+    report = ReportWriter()
     if not args:
         args = {}
-    for node in nm.nodes.values():
+    found = False
+    # every node section is written as soon as its analysis is done
+    for node in sorted(nm.nodes.values(), key=report_order):
+        output = {}
         args['node'] = node
         args['output'] = output
         function(**args)
-    if output:
-        pretty_print(output)
-    else:
+        if output:
+            found = True
+            if store:
+                store.write(output, check)
+            if writer:
+                writer.write(output, check)
+            else:
+                report.write(output)
+    if not found:
         print(ok_message)
+    elif writer:
+        print('FOUND')
+
+
+def records_output(records):
+    '''Builds a dict in output_add format from history records'''
+    output = {}
+    for r in records:
+        message = r['message']
+        if r['package']:
+            message = '%s: %s' % (' '.join([x for x in [r['package'],
+                                                         r['version']] if x]),
+                                  message)
+        if r['env'] == 0:
+            node_output = output.setdefault('fuel', {})
+        else:
+            env = output.setdefault(r['env'], {})
+            node = env.setdefault(r['node'], {'roles': r['roles'].split(', '),
+                                              'output': {}})
+            node_output = node['output']
+        node_output.setdefault(r['check'], []).append(message)
+    return output
+
+
+def diff(argv):
+    parser = argparse.ArgumentParser(
+        prog='cudet diff',
+        description='Show findings which are new or resolved between runs')
+    parser.add_argument('-c', '--config',
+                        help='Path to user config file')
+    parser.add_argument('-r', '--run', type=int,
+                        help='Run id to check, the latest run by default')
+    parser.add_argument('-s', '--since', type=int,
+                        help=('Run id to compare with, the run preceding '
+                              'the checked run by default'))
+    parser.add_argument('-l', '--list',
+                        default=False, action='store_true',
+                        help='List stored runs')
+    args = parser.parse_args(argv[1:])
+
+    conf = configuration.get_config(args)
+    history_file = conf['history_file']
+    if not os.path.isfile(history_file):
+        print('No results history found in %s' % history_file)
+        return 1
+    store = history.History(history_file)
+    runs = store.runs()
+    if args.list:
+        for run_id, started, finished, fake in runs:
+            print('%s: %s - %s%s' % (run_id, started, finished,
+                                     ' (fake)' if fake else ''))
+        return 0
+    ids = [r[0] for r in runs]
+    new_run = args.run or (ids[-1] if ids else None)
+    old_run = args.since
+    if old_run is None and new_run in ids and ids.index(new_run) > 0:
+        old_run = ids[ids.index(new_run) - 1]
+    if new_run is None or old_run is None:
+        print('Not enough runs to compare, use -l to list stored runs')
+        return 1
+    new, resolved = store.diff(old_run, new_run)
+    store.close()
+    print('Changes from run %s to run %s:' % (old_run, new_run))
+    sys.stdout.write('  New findings: ')
+    if new:
+        pretty_print(records_output(new))
+    else:
+        print('NONE')
+    sys.stdout.write('  Resolved findings: ')
+    if resolved:
+        pretty_print(records_output(resolved))
+    else:
+        print('NONE')
+    return 0
 
 
 def _setup_logging(debug):
@@ -468,11 +651,20 @@ def _setup_logging(debug):
 @interrupt_wrapper
 def main(argv=None):
     sys.stdout = Unbuffered(sys.stdout)
+    if argv is None:
+        argv = sys.argv
+    if len(argv) > 1 and argv[1] == 'diff':
+        return diff(argv[1:])
     parser = argparse.ArgumentParser()
     parser.add_argument('-f', '--fake',
                         help=('Do not perform remote commands, use already '
                               'collected data'),
                         action='store_true')
+    parser.add_argument('--resume',
+                        help=('Collect only outputs which are missing or '
+                              'failed in the previous run, according to '
+                              'the per-node manifests in outdir'),
+                        action='store_true')
     parser.add_argument('-c', '--config',
                         help='Path to user config file')
     parser.add_argument('-e', '--env', nargs='*', type=int,
@@ -480,39 +672,113 @@ def main(argv=None):
                               'environment ids'))
     parser.add_argument('-n', '--node', nargs='*', type=int,
                         help='Perform check only for specified node ids')
+    parser.add_argument('-b', '--md5-baseline',
+                        default=False, action='store_true',
+                        help=('Verify md5 sums on the master against the '
+                              'md5 baseline database instead of running '
+                              'dpkg/rpm --verify on nodes'))
+    parser.add_argument('--format', default='yaml', choices=formats.FORMATS,
+                        help=('Results format, yaml is a human-readable '
+                              'report, other formats contain one record per '
+                              'finding'))
+    parser.add_argument('-o', '--output-file',
+                        help=('Write results to a file instead of stdout, '
+                              'mandatory for sqlite format'))
+    parser.add_argument('--stats',
+                        help=('Write a JSON summary of per-phase and '
+                              'per-node timings to this file'))
+    parser.add_argument('--profile',
+                        help=('Write cProfile stats of the analysis phase '
+                              'to this file'))
     parser.add_argument('-d', '--debug',
                         default=False, action='store_true',
                         help='Turn on debug messages')
-    if argv is None:
-        argv = sys.argv
     args = parser.parse_args(argv[1:])
+    if args.format == 'sqlite' and not args.output_file:
+        parser.error('sqlite format requires --output-file')
 
     _setup_logging(args.debug)
 
+    writer = formats.get_writer(args.format, args.output_file,
+                                stream=sys.stdout.stream)
+    if writer and not args.output_file:
+        # results go to stdout, progress messages to stderr
+        sys.stdout = Unbuffered(sys.stderr)
+
+    stats = timings.Timings()
     try:
-        conf = configuration.get_config(args)
-        nm = node_manager_init(conf)
+        with stats.phase('init'):
+            conf = configuration.get_config(args)
+            nm = node_manager_init(conf, fake=args.fake)
     except Exception as e:
         print("There are no nodes to check")
         raise e
 
-    versions_dict, output = load_versions_dict(conf, nm)
+    store = None
+    if conf['history']:
+        store = history.History(conf['history_file'])
+        store.start_run(nm.nodes.values(), fake=args.fake)
+
+    with stats.phase('load_versions_dict'):
+        versions_dict, output = load_versions_dict(conf, nm)
     if not versions_dict:
         print("[ERROR] Could't load databases.")
         return 1
     if output:
-        pretty_print(output)
+        if store:
+            store.write(output, 'database')
+        if writer:
+            writer.write(output, 'database')
+        else:
+            pretty_print(output)
+
+    if conf['md5_baseline']:
+        use_md5_baseline(nm)
 
     sys.stdout.write('Collecting data from %d nodes: ' % len(nm.nodes))
-    nm.run_commands(conf['outdir'], fake=args.fake)
+    with stats.phase('run_commands'):
+        nm.run_commands(conf['outdir'], fake=args.fake, resume=args.resume,
+                        lock_wait=conf['run_lock_wait'])
+    stats.concurrency = nm.concurrency
+    for node in nm.nodes.values():
+        stats.add_node(node)
     print('DONE')
     print('Results:')
-    perform('  Versions verification analysis', verify_versions, nm,
-            {'versions_dict': versions_dict}, 'OK')
-    perform('  Built-in md5 verification analysis',
-            verify_md5_builtin_show_results, nm, {'conf': conf}, 'OK')
-    perform('  Potential updates', update_candidates, nm,
-            {'versions_dict': versions_dict}, 'ALL NODES UP-TO-DATE')
+    profile = None
+    if args.profile:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+    with stats.phase('analysis: versions'):
+        perform('  Versions verification analysis', verify_versions, nm,
+                {'versions_dict': versions_dict}, 'OK', 'versions', writer,
+                store)
+    with stats.phase('analysis: md5'):
+        if conf['md5_baseline']:
+            perform('  Baseline md5 verification analysis',
+                    verify_md5_baseline_show_results, nm,
+                    {'conf': conf,
+                     'md5_baseline': baseline.Md5Baseline(
+                         conf['cudet_db_dir'])},
+                    'OK', 'md5', writer, store)
+        else:
+            perform('  Built-in md5 verification analysis',
+                    verify_md5_builtin_show_results, nm, {'conf': conf},
+                    'OK', 'md5', writer, store)
+    with stats.phase('analysis: updates'):
+        perform('  Potential updates', update_candidates, nm,
+                {'versions_dict': versions_dict}, 'ALL NODES UP-TO-DATE',
+                'updates', writer, store)
+    if profile:
+        profile.disable()
+        profile.dump_stats(args.profile)
+    if writer:
+        writer.close()
+    if store:
+        store.finish_run()
+        store.close()
+    if args.stats:
+        stats.dump(args.stats)
     return 0
 
 
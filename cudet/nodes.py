@@ -17,14 +17,18 @@ import datetime
 import logging
 import json
 import os
+import pipes
 import shutil
 import sys
+import time
 
 from collections import Iterable
+from multiprocessing.pool import ThreadPool
 
 from cudet import configuration
 from cudet import exceptions
 from cudet import fuel_client
+from cudet import scheduler
 from cudet import utils
 from six import string_types
 
@@ -49,9 +53,14 @@ class Node(object):
     conf_priority_section = conf_match_prefix + 'id'
     header = ['node-id', 'env', 'ip', 'mac', 'os',
               'roles', 'online', 'status', 'name', 'fqdn']
+    # complete outputs of the node, see exec_cmd
+    manifest_file = 'manifest.json'
+    # full inputs and outputs of commands if transcripts are enabled
+    transcripts_dir = 'transcripts'
 
     def __init__(self, id, name, fqdn, mac, cluster, release, roles,
-                 os_platform, online, status, ip, conf, logger=None):
+                 os_platform, online, status, ip, conf, logger=None,
+                 conf_cache=None):
         self.id = id
         self.mac = mac
         self.cluster = cluster
@@ -75,12 +84,32 @@ class Node(object):
         self.fqdn = fqdn
         self.outputs_timestamp = False
         self.outputs_timestamp_dir = None
-        self.apply_conf(conf)
+        self.outputs_compression = None
+        self.transit_compression = {}
+        self.debug_preview = utils.DEBUG_PREVIEW
+        self.transcripts = False
+        # heavy scripts and the I/O budget semaphores held while running
+        # them, see scheduler.IOBudget
+        self.io_scripts = set()
+        self.io_locks = []
+        self.apply_conf(conf, cache=conf_cache)
         self.logger = logger or logging.getLogger(__name__)
 
-    def apply_conf(self, conf, clean=True):
+    def apply_conf(self, conf, clean=True, cache=None):
+        """Sets node attributes from conf and its sections matching the
+        node, with a ConfCache of conf the result is computed once per
+        distinct set of matched attribute values"""
+        key = None
+        if clean and cache is not None and cache.conf is conf:
+            key = cache.signature(self)
+            if key in cache.results:
+                for k, v in cache.results[key].items():
+                    setattr(self, k, _unshared(v))
+                return
+        touched = set()
 
         def apply(k, v, c_a, k_d, o, default=False):
+            touched.add(k)
             if k in c_a:
                 if any([default,
                         k not in k_d and k not in o,
@@ -135,13 +164,27 @@ class Node(object):
             duplication if this function gets called more than once'''
             for f in set(c_a).intersection(k_d):
                 setattr(self, f, [])
+                touched.add(f)
         r_apply(conf, p, p_s, c_a, k_d, overridden, d, clean=clean)
-
-    def exec_cmd(self, fake=False, ok_codes=None):
+        if key is not None:
+            cache.results[key] = dict((k, _unshared(getattr(self, k)))
+                                      for k in touched)
+
+    def exec_cmd(self, fake=False, ok_codes=None, resume=False,
+                 shared_since=None):
+        started = time.time()
+        timings = {'commands': {}, 'io_wait': 0.0, 'resumed': 0}
         sn = 'node-%s' % self.id
         cl = 'cluster-%s' % self.cluster
         self.logger.debug('%s/%s/%s/%s' % (self.outdir, Node.ckey, cl, sn))
         ddir = os.path.join(self.outdir, Node.ckey, cl, sn)
+        manifest = {}
+        if fake or resume:
+            manifest = self.load_manifest(ddir)
+            # previous outputs which succeeded are used as well
+            shared_since = None
+        elif shared_since:
+            manifest = self.load_manifest(ddir)
         if self.cmds:
             utils.mdir(ddir)
         self.cmds = sorted(self.cmds)
@@ -152,22 +195,27 @@ class Node(object):
                                      (self.id, self.ip, cmd))
                 if self.outputs_timestamp:
                         dfile += self.outputs_timestamp_str
+                dfile += self._output_suffix()
+                if self._reuse(manifest, cmd, fake, ok_codes, shared_since):
+                    mapcmds[cmd] = manifest[cmd]['file']
+                    timings['resumed'] += int(not fake)
+                    continue
                 self.logger.info('outfile: %s' % dfile)
                 mapcmds[cmd] = dfile
                 if not fake:
+                    t = time.time()
                     outs, errs, code = utils.ssh_node(ip=self.ip,
                                                       command=c[cmd],
                                                       ssh_opts=self.ssh_opts,
                                                       env_vars=self.env_vars,
                                                       timeout=self.timeout,
-                                                      prefix=self.prefix)
+                                                      prefix=self.prefix,
+                                                      **self._log_opts())
+                    timings['commands'][cmd] = {'wall': time.time() - t,
+                                                'bytes': len(outs),
+                                                'code': code}
                     self.check_code(code, 'exec_cmd', c[cmd], errs, ok_codes)
-                    try:
-                        with open(dfile, 'w') as df:
-                            df.write(outs.encode('utf-8'))
-                    except:
-                        self.logger.error("can't write to file %s" %
-                                          dfile)
+                    self._save_output(ddir, manifest, cmd, dfile, outs, code)
         if self.scripts:
             utils.mdir(ddir)
         scripts = sorted(self.scripts)
@@ -182,28 +230,100 @@ class Node(object):
                 f = scr
             else:
                 f = os.path.join(self.rqdir, Node.skey, scr)
-            self.logger.info('node:%s(%s), exec: %s' % (self.id, self.ip, f))
             dfile = os.path.join(ddir, 'node-%s-%s-%s' %
                                  (self.id, self.ip, os.path.basename(f)))
             if self.outputs_timestamp:
                     dfile += self.outputs_timestamp_str
+            dfile += self._output_suffix()
+            if self._reuse(manifest, scr, fake, ok_codes, shared_since):
+                mapscr[scr] = manifest[scr]['file']
+                timings['resumed'] += int(not fake)
+                continue
+            self.logger.info('node:%s(%s), exec: %s' % (self.id, self.ip, f))
             self.logger.info('outfile: %s' % dfile)
             mapscr[scr] = dfile
             if not fake:
-                outs, errs, code = utils.ssh_node(ip=self.ip,
-                                                  filename=f,
-                                                  ssh_opts=self.ssh_opts,
-                                                  env_vars=env_vars,
-                                                  timeout=self.timeout,
-                                                  prefix=self.prefix)
+                if os.path.basename(f) in self.io_scripts:
+                    locks = self.io_locks
+                else:
+                    locks = []
+                compress = (
+                    self.transit_compression.get('enabled', False) and
+                    os.path.basename(f) in
+                    self.transit_compression.get('scripts', []))
+                with scheduler.hold(locks) as io_wait:
+                    t = time.time()
+                    outs, errs, code = utils.ssh_node(ip=self.ip,
+                                                      filename=f,
+                                                      ssh_opts=self.ssh_opts,
+                                                      env_vars=env_vars,
+                                                      timeout=self.timeout,
+                                                      prefix=self.prefix,
+                                                      compress=compress,
+                                                      **self._log_opts())
+                    timings['commands'][scr] = {'wall': time.time() - t,
+                                                'bytes': len(outs),
+                                                'code': code,
+                                                'io_wait': io_wait}
+                timings['io_wait'] += io_wait
                 self.check_code(code, 'exec_cmd', 'script %s' % f, errs,
                                 ok_codes)
-                try:
-                    with open(dfile, 'w') as df:
-                        df.write(outs.encode('utf-8'))
-                except:
-                    self.logger.error("can't write to file %s" % dfile)
-        return mapcmds, mapscr
+                self._save_output(ddir, manifest, scr, dfile, outs, code)
+        timings['wall'] = time.time() - started
+        return mapcmds, mapscr, timings
+
+    def load_manifest(self, ddir):
+        """Returns {command or script: {file, code, bytes, finished}} of
+        outputs saved by previous runs, {} if there is no manifest"""
+        filename = os.path.join(ddir, Node.manifest_file)
+        if not os.path.exists(filename):
+            return {}
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            self.logger.warning('node %s: cannot read manifest %s: %s' %
+                                (self.id, filename, e))
+            return {}
+
+    def _reuse(self, manifest, name, fake, ok_codes=None, since=None):
+        """Checks if a complete output of a previous run can be used
+
+        With since (a timestamp) only outputs finished after it are used,
+        also if the command failed, they come from a concurrent run.
+        """
+        if not manifest:
+            return False
+        entry = manifest.get(name)
+        if entry and os.path.exists(entry['file']):
+            if since:
+                return entry['finished'] >= datetime.datetime.fromtimestamp(
+                    int(since)).strftime('%F %H:%M:%S')
+            if not entry['code'] or entry['code'] in (ok_codes or []):
+                return True
+        if fake:
+            self.logger.warning('node %s: output of %s is missing or '
+                                'incomplete' % (self.id, name))
+        return False
+
+    def _output_suffix(self):
+        return utils.COMPRESSION_SUFFIXES.get(self.outputs_compression, '')
+
+    def _save_output(self, ddir, manifest, name, dfile, outs, code):
+        """Writes an output and records it in the manifest, both atomically
+        so that interrupted runs leave no partial files"""
+        try:
+            utils.write_atomic(dfile, utils.compress(
+                outs.encode('utf-8'), self.outputs_compression))
+            manifest[name] = {
+                'file': dfile,
+                'code': code,
+                'bytes': len(outs),
+                'finished': datetime.datetime.now().strftime('%F %H:%M:%S')}
+            utils.write_atomic(os.path.join(ddir, Node.manifest_file),
+                               json.dumps(manifest, indent=2, sort_keys=True))
+        except:
+            self.logger.error("can't write to file %s" % dfile)
 
     def exec_simple_cmd(self, cmd, timeout=15, infile=None, outfile=None,
                         fake=False, ok_codes=None, input=None):
@@ -217,9 +337,18 @@ class Node(object):
                                               outputfile=outfile,
                                               ok_codes=ok_codes,
                                               input=input,
-                                              prefix=self.prefix)
+                                              prefix=self.prefix,
+                                              **self._log_opts())
             self.check_code(code, 'exec_simple_cmd', cmd, errs, ok_codes)
 
+    def _log_opts(self):
+        """Debug logging arguments of utils.ssh_node"""
+        transcript = None
+        if self.transcripts:
+            transcript = os.path.join(self.outdir, Node.transcripts_dir,
+                                      'node-%s.log' % self.id)
+        return {'preview': self.debug_preview, 'transcript': transcript}
+
     def check_code(self, code, func_name, cmd, err, ok_codes=None):
         if code:
             if not ok_codes or code not in ok_codes:
@@ -229,10 +358,62 @@ class Node(object):
                                      func_name, cmd, code, err))
 
 
+def _unshared(value):
+    # values are shared between nodes, lists get their own copy since
+    # apply_conf with clean=False extends them in place
+    return list(value) if isinstance(value, list) else value
+
+
+class ConfCache(object):
+    """Results of Node.apply_conf for a configuration
+
+    apply_conf only reads the node attributes named in by_<attr> sections
+    and the id if it is listed in a by_id section, so nodes with equal
+    values of those share one result.
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.attrs = set()
+        self.ids = set()
+        self._collect(conf)
+        self.attrs = sorted(self.attrs)
+        self.results = {}
+
+    def _collect(self, el):
+        p = Node.conf_match_prefix
+        p_s = Node.conf_priority_section
+        for k in el:
+            if not isinstance(k, string_types) or \
+                    not isinstance(el[k], dict):
+                continue
+            if k == p_s:
+                self.ids.update(i for i in el[k] if i != Node.conf_default_key)
+            elif k.startswith(p):
+                self.attrs.add(k[len(p):])
+                for subconf in el[k].values():
+                    if isinstance(subconf, dict):
+                        self._collect(subconf)
+
+    def signature(self, node):
+        """Returns the cache key of a node, None if it cannot be cached"""
+        values = []
+        for attr in self.attrs:
+            value = getattr(node, attr, None)
+            values.append(tuple(value) if isinstance(value, list) else value)
+        key = (tuple(values), node.id if node.id in self.ids else None)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+
 class NodeManager(object):
     """Class nodes """
 
-    def __init__(self, conf, nodes_json=None, logger=None):
+    def __init__(self, conf, nodes_json=None, logger=None, release_map=None,
+                 fake=False):
         self.conf = conf
         self.logger = logger or logging.getLogger(__name__)
 
@@ -244,7 +425,13 @@ class NodeManager(object):
                 conf.outdir += timestamp_str
 
         if conf.clean:
-            shutil.rmtree(conf.outdir, ignore_errors=True)
+            if utils.lock_holder('_run_commands',
+                                 self._run_lock_key()) is None:
+                shutil.rmtree(conf.outdir, ignore_errors=True)
+            else:
+                # its outputs are going to be used by this run
+                self.logger.warning('data is being collected by another '
+                                    'process, not cleaning %s' % conf.outdir)
 
         self.rqdir = conf.rqdir
         if not os.path.exists(self.rqdir):
@@ -255,30 +442,47 @@ class NodeManager(object):
             self._import_rq()
 
         self.nodes = {}
+        self.concurrency = None
+        self.conf_cache = ConfCache(self.conf)
         self.nodes_filter = NodeFilter()
-        self.fuel_client = fuel_client.get_client(self.conf)
-
-        if self.fuel_client is None:
-            self.cli_creds = 'OS_TENANT_NAME={tenant} OS_USERNAME={user} ' \
-                             'OS_PASSWORD={password}'.\
-                format(tenant=self.conf.fuel_tenant,
-                       user=self.conf.fuel_user,
-                       password=self.conf.fuel_pass)
-
-        if self.nodes_filter.check_master:
-            self._fuel_node_init()
+        self._fuel_client = None
+        self._fuel_client_init = False
+        self.cli_creds = 'OS_TENANT_NAME={tenant} OS_USERNAME={user} ' \
+                         'OS_PASSWORD={password}'.\
+            format(tenant=self.conf.fuel_tenant,
+                   user=self.conf.fuel_user,
+                   password=self.conf.fuel_pass)
 
         if nodes_json is not None:
             self.nodes_json = utils.load_json_file(nodes_json)
+            master_release = None
+            if self.nodes_filter.check_master:
+                master_release = self.get_master_release()
         else:
-            if not self.get_nodes():
+            inventory = self.get_inventory(fake)
+            if inventory is None:
                 sys.exit(4)
+            self.nodes_json, inventory_map, master_release = inventory
+            if release_map is None:
+                release_map = inventory_map
 
-        self._nodes_init()
+        if self.nodes_filter.check_master:
+            self._fuel_node_init(master_release)
+
+        self._nodes_init(release_map)
 
         self.nodes_reapply_conf()
         self._conf_assign_once()
 
+    @property
+    def fuel_client(self):
+        """Fuel client, None if CLI is used instead - initialized on first
+        use since runs using the inventory snapshot do not need it"""
+        if not self._fuel_client_init:
+            self._fuel_client = fuel_client.get_client(self.conf)
+            self._fuel_client_init = True
+        return self._fuel_client
+
     def _import_rq(self):
 
         def sub_is_match(el, d, p, once_p):
@@ -326,13 +530,11 @@ class NodeManager(object):
         for attr in src:
             r_sub(attr, src, attr, d, p, once_p, dst)
 
-    def _fuel_node_init(self):
+    def _fuel_node_init(self, fuel_release):
         if not self.conf.fuel_ip:
             self.logger.critical('NodeManager: fuel_ip is not set')
             sys.exit(7)
 
-        fuel_release = self.get_master_release()
-
         fuelnode = Node(id=0,
                         cluster=0,
                         name='fuel',
@@ -344,9 +546,92 @@ class NodeManager(object):
                         status='ready',
                         online=True,
                         ip=self.conf.fuel_ip,
-                        conf=self.conf)
+                        conf=self.conf,
+                        conf_cache=self.conf_cache)
         self.nodes[self.conf.fuel_ip] = fuelnode
 
+    def get_inventory(self, fake=False):
+        """Returns (nodes_json, release_map, master_release), None if the
+        node list cannot be fetched
+
+        A snapshot younger than inventory_ttl seconds is used instead of
+        the Fuel API, with fake=True regardless of its age. Otherwise the
+        node list, the releases of environments and, if the master is
+        checked, the master release are requested at the same time.
+        """
+        inventory = self._load_inventory(fake)
+        if inventory is not None:
+            return inventory
+        results = None
+        if self.fuel_client is None:
+            results = self._get_inventory_cli()
+        if results is None:
+            calls = [self.get_nodes, self.get_slave_nodes_release]
+            if self.nodes_filter.check_master:
+                calls.append(self.get_master_release)
+            pool = ThreadPool(len(calls))
+            try:
+                results = pool.map(lambda call: call(), calls)
+            finally:
+                pool.close()
+        if not results[0]:
+            return None
+        release_map = results[1]
+        master_release = results[2] if len(results) > 2 else None
+        if release_map is not None and (
+                master_release is not None or
+                not self.nodes_filter.check_master):
+            self._save_inventory(release_map, master_release)
+        return self.nodes_json, release_map, master_release
+
+    def _load_inventory(self, fake=False):
+        filename = self.conf.inventory_snapshot
+        if not filename or not self.conf.inventory_ttl:
+            return None
+        try:
+            with open(filename, 'r') as f:
+                inventory = json.load(f)
+        except (IOError, ValueError) as e:
+            self.logger.debug('no Fuel inventory snapshot: %s' % e)
+            return None
+        age = time.time() - inventory.get('time', 0)
+        if inventory.get('fuel_ip') != self.conf.fuel_ip:
+            return None
+        if not fake and not 0 <= age <= self.conf.inventory_ttl:
+            return None
+        clusters = inventory.get('clusters')
+        if clusters not in (None, self.nodes_filter.api_clusters()):
+            # nodes of other environments are missing from the snapshot
+            return None
+        master_release = inventory.get('master_release')
+        if self.nodes_filter.check_master and master_release is None:
+            return None
+        self.logger.info('using Fuel inventory snapshot %s, %d seconds old' %
+                         (filename, age))
+        # json keys are strings, environment ids are integers
+        release_map = dict((int(k), v) for k, v in
+                           inventory['release_map'].items())
+        return inventory['nodes'], release_map, master_release
+
+    def _save_inventory(self, release_map, master_release):
+        filename = self.conf.inventory_snapshot
+        if not filename or not self.conf.inventory_ttl:
+            return
+        inventory = {'time': time.time(),
+                     'fuel_ip': self.conf.fuel_ip,
+                     'nodes': self.nodes_json,
+                     'clusters': self.nodes_filter.api_clusters(),
+                     'release_map': release_map,
+                     'master_release': master_release}
+        try:
+            dirname = os.path.dirname(filename)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            utils.write_atomic(filename, json.dumps(inventory))
+        except (IOError, OSError) as e:
+            self.logger.warning('cannot save Fuel inventory snapshot to '
+                                '%s: %s' % (filename, e))
+
     def get_nodes(self):
         if self.fuel_client is not None:
             return self._get_nodes_fuelclient()
@@ -357,7 +642,15 @@ class NodeManager(object):
         if not self.fuel_client:
             return False
         try:
-            self.nodes_json = self.fuel_client.get_request('nodes')
+            clusters = self.nodes_filter.api_clusters()
+            if clusters is None:
+                self.nodes_json = self.fuel_client.get_request('nodes')
+            else:
+                # only nodes of the filtered environments are requested
+                self.nodes_json = []
+                for cluster in clusters:
+                    self.nodes_json.extend(self.fuel_client.get_request(
+                        'nodes', params={'cluster_id': cluster}))
             self.logger.debug(self.nodes_json)
             return True
         except Exception as e:
@@ -366,10 +659,76 @@ class NodeManager(object):
                                 exc_info=True)
             return False
 
+    def _get_inventory_cli(self):
+        """Runs the CLI commands of get_inventory in parallel in a single
+        ssh session to the master, returns the same list as the separate
+        calls or None if the batch cannot be used"""
+        self.logger.info('use CLI for getting inventory in one session')
+        cmds = [('nodes', self._nodes_cli_cmd()),
+                ('clusters', 'fuel environment --json')]
+        if self.nodes_filter.check_master:
+            cmds.append(('version', 'fuel --fuel-version --json'))
+
+        # the outputs are framed into one JSON document:
+        # {"<name>": {"code": <exit code>, "data": <output or null>}, ...}
+        script = ['d=$(mktemp -d)', 'trap \'rm -rf "$d"\' EXIT']
+        for name, cmd in cmds:
+            script.append('%s > "$d/%s" & p_%s=$!' % (cmd, name, name))
+        script.append("printf '{'")
+        for i, (name, cmd) in enumerate(cmds):
+            script += [
+                'wait $p_%s; c=$?' % name,
+                "printf '%s\"%s\": {\"code\": %%d, \"data\": ' $c" %
+                (', ' if i else '', name),
+                'if [ $c -eq 0 ] && [ -s "$d/%s" ]; then cat "$d/%s"; '
+                'else printf null; fi' % (name, name),
+                "printf '}'"]
+        script.append("printf '}\\n'")
+
+        out, err, code = utils.ssh_node(
+            ip=self.conf.fuel_ip,
+            command='bash -c %s' % pipes.quote('\n'.join(script)),
+            env_vars=self.cli_creds,
+            ssh_opts=self.conf.ssh_opts,
+            timeout=self.conf.timeout)
+        try:
+            if code != 0:
+                raise ValueError('exit code %s: %s' % (code, err))
+            inventory = json.loads(out)
+        except ValueError as e:
+            self.logger.warning('NodeManager: cannot get inventory from CLI '
+                                'in one session, using separate calls: %s'
+                                % e)
+            return None
+        for name, cmd in cmds:
+            if inventory[name]['code'] != 0:
+                self.logger.warning("NodeManager: '%s' exited %d: %s" %
+                                    (cmd, inventory[name]['code'], err))
+
+        self.nodes_json = inventory['nodes']['data']
+        release_map = None
+        if inventory['clusters']['data'] is not None:
+            release_map = self._release_map(inventory['clusters']['data'])
+        master_release = None
+        if 'version' in inventory:
+            master_release = (inventory['version']['data'] or
+                              {}).get('release')
+            if master_release is None:
+                self.logger.warning('NodeManager: cannot get fuel release')
+        return [self.nodes_json is not None, release_map, master_release]
+
+    def _nodes_cli_cmd(self):
+        clusters = self.nodes_filter.api_clusters()
+        if clusters is not None and len(clusters) == 1:
+            # one CLI start per environment would cost more than listing
+            # all nodes, so only a single environment is requested
+            return 'fuel node list --env %d --json' % clusters[0]
+        return 'fuel node list --json'
+
     def _get_nodes_cli(self):
         self.logger.info('use CLI for getting node information')
 
-        cmd = 'fuel node list --json'
+        cmd = self._nodes_cli_cmd()
 
         nodes_json_str, err, code = utils.ssh_node(ip=self.conf.fuel_ip,
                                                    command=cmd,
@@ -441,13 +800,7 @@ class NodeManager(object):
             self.logger.error(e, exc_info=True)
             return None
 
-        release_map = dict(
-            (
-                cluster['id'], cluster['fuel_version']
-            ) for cluster in clusters
-        )
-
-        return release_map
+        return self._release_map(clusters)
 
     def _get_slaves_release_fuel_cli(self):
         self.logger.info('use CLI for getting nodes release')
@@ -468,16 +821,19 @@ class NodeManager(object):
 
         clusters_info = json.loads(clusters_info_str)
 
-        release_map = dict(
+        return self._release_map(clusters_info)
+
+    @staticmethod
+    def _release_map(clusters):
+        return dict(
             (
                 cluster['id'], cluster['fuel_version']
-            ) for cluster in clusters_info
+            ) for cluster in clusters
         )
 
-        return release_map
-
-    def _nodes_init(self):
-        release_map = self.get_slave_nodes_release()
+    def _nodes_init(self, release_map=None):
+        if release_map is None:
+            release_map = self.get_slave_nodes_release()
 
         filtered_nodes = self.nodes_filter.filter_nodes(self.nodes_json)
 
@@ -507,7 +863,8 @@ class NodeManager(object):
                       'cluster': cluster_id,
                       'release': node_release,
                       'roles': roles,
-                      'conf': self.conf}
+                      'conf': self.conf,
+                      'conf_cache': self.conf_cache}
 
             for key in keys:
                 params[key] = node_data[key]
@@ -553,20 +910,73 @@ class NodeManager(object):
                         break
 
     def nodes_reapply_conf(self):
+        # the configuration may have changed since the results were cached
+        self.conf_cache = ConfCache(self.conf)
         for node in self.nodes.values():
-            node.apply_conf(self.conf)
+            node.apply_conf(self.conf, cache=self.conf_cache)
+
+    def _run_lock_key(self):
+        # only runs collecting into the same outdir can share outputs
+        return os.path.realpath(self.conf.outdir)
+
+    def run_commands(self, timeout=15, fake=False, maxthreads=None,
+                     resume=False, lock_wait=None):
+        """Collects outputs of all nodes
+
+        If another process is collecting into the same outdir, waits for it
+        (at most lock_wait seconds, see utils.run_with_lock) and uses the
+        outputs it finished instead of collecting them again
+        """
+        return self._run_commands(timeout, fake, maxthreads, resume,
+                                  lock_key=self._run_lock_key(),
+                                  lock_wait=lock_wait)
 
     @utils.run_with_lock
-    def run_commands(self, timeout=15, fake=False, maxthreads=100):
+    def _run_commands(self, timeout=15, fake=False, maxthreads=None,
+                      resume=False, waited_for=None):
+        """
+        :param waited_for: set by utils.run_with_lock if this run waited
+                           for another process collecting at the same time,
+                           outputs finished by it in outdir are used instead
+                           of collecting them again
+        """
+        if maxthreads is None:
+            maxthreads = self.conf.maxthreads
+        limiter = scheduler.get_limiter(maxthreads, self.conf.concurrency)
+        compression = utils.compression_method(self.conf.outputs_compression)
+        for node in self.nodes.values():
+            node.outputs_compression = compression
+        budget = scheduler.IOBudget(self.conf.io_budget)
+        if budget.enabled and not fake:
+            for node in self.nodes.values():
+                node.io_scripts = budget.scripts
+                node.io_locks = budget.locks(node)
+            limiter.idle_time = lambda result: result[2]['io_wait']
+        durations_file = self.conf.durations_file
+        nodes = self.nodes.values()
+        if self.conf.longest_first:
+            durations = {}
+            if durations_file:
+                durations = scheduler.load_durations(durations_file)
+            nodes = scheduler.longest_first(nodes, durations,
+                                            self.conf.role_weights)
         run_items = []
-        for key, node in self.nodes.items():
-            run_items.append(utils.RunItem(target=node.exec_cmd,
-                                           args={'fake': fake},
-                                           key=key))
-        result = utils.run_batch(run_items, maxthreads, dict_result=True)
+        for node in nodes:
+            run_items.append(utils.RunItem(
+                target=node.exec_cmd,
+                args={'fake': fake,
+                      'resume': resume,
+                      'shared_since': (waited_for or {}).get('started')},
+                key=node.ip))
+        result = utils.run_batch(run_items, maxthreads, dict_result=True,
+                                 limiter=limiter)
+        self.concurrency = limiter.summary()
         for key in result:
             self.nodes[key].mapcmds = result[key][0]
             self.nodes[key].mapscr = result[key][1]
+            self.nodes[key].timings = result[key][2]
+        if durations_file and not fake:
+            scheduler.save_durations(durations_file, self.nodes.values())
 
 
 class NodeFilter(object):
@@ -586,16 +996,38 @@ class NodeFilter(object):
     def check_master(self):
         return self.filters.get('check_master', False)
 
-    def filter_nodes(self, nodes_info):
-
-        filtered_nodes = copy.deepcopy(nodes_info)
-        filter_attrs = self._prepare_filter_attrs()
+    def api_clusters(self):
+        """Returns the sorted environment ids the node list can be
+        requested for instead of all nodes, None if it is not filtered by
+        environment"""
+        return sorted(set(self.filters.get('cluster') or [])) or None
+
+    def predicate(self):
+        """Returns a function telling whether a node passes all filters,
+        filter values are converted to sets once"""
+        tests = [(attr, _to_set(self.filters[attr]))
+                 for attr in self._prepare_filter_attrs()]
+        online = self.filters.get('online', False)
+
+        def match(node):
+            if online and not node.get('online'):
+                return False
+            for attr, values in tests:
+                value = node.get(attr)
+                # attr from node can be a string or a list
+                if isinstance(value, string_types) or \
+                        not isinstance(value, Iterable):
+                    if value not in values:
+                        return False
+                elif values.isdisjoint(value):
+                    return False
+            return True
 
-        for filter_attr in filter_attrs:
-            filtered_nodes = self._do_filter(filtered_nodes, filter_attr)
+        return match
 
-        self._online_filter(filtered_nodes)
-        return filtered_nodes
+    def filter_nodes(self, nodes_info):
+        match = self.predicate()
+        return [node for node in nodes_info if match(node)]
 
     def _prepare_filter_attrs(self):
         filter_attrs = [attr for attr in self.filters.keys()
@@ -606,21 +1038,8 @@ class NodeFilter(object):
 
         return non_empty_filter_attrs
 
-    @staticmethod
-    def _online_filter(nodes_info):
-        return [node for node in nodes_info if node.get('online')]
-
-    def _do_filter(self, nodes_info, attr):
-        # attr from node can be a string or a list
-        # so we have to handle it properly
-        # TODO: refactor this ugly solution
-        def _to_set(data):
-            return set([data]) if \
-                isinstance(data, string_types) or \
-                not isinstance(data, Iterable) else set(data)
-
-        return [node for node in nodes_info
-                if len(
-                    _to_set(node.get(attr)).intersection(
-                        _to_set(self.filters[attr]))
-                ) > 0]
+
+def _to_set(data):
+    return set([data]) if \
+        isinstance(data, string_types) or \
+        not isinstance(data, Iterable) else set(data)
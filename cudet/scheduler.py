@@ -0,0 +1,338 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Concurrency limits for utils.run_batch
+"""
+
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# adjustment records kept in the summary
+MAX_ADJUSTMENTS = 100
+# number of first finished items giving the reference latency
+BASELINE_SAMPLES = 10
+# weight of a new sample in the moving average of the latency
+LATENCY_ALPHA = 0.1
+
+
+def _load_per_cpu():
+    try:
+        return os.getloadavg()[0] / multiprocessing.cpu_count()
+    except (OSError, AttributeError):
+        return None
+
+
+def _available_memory_mb():
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except IOError:
+        pass
+    return None
+
+
+class FixedLimit(object):
+    """Constant concurrency limit, the summary reports the throughput"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.initial = limit
+        self.peak_running = 0
+        self.items = 0
+        self.begin = None
+        self.end = None
+        self.last_tick = None
+        self.running_time = 0.0
+
+    def started(self):
+        if self.begin is None:
+            self.begin = time.time()
+            self.last_tick = self.begin
+
+    def finished(self, wall, result=None):
+        self.items += 1
+        self.end = time.time()
+
+    def update(self, running):
+        now = time.time()
+        if self.last_tick is not None:
+            self.running_time += running * (now - self.last_tick)
+        self.last_tick = now
+        self.peak_running = max(self.peak_running, running)
+
+    def summary(self):
+        wall = (self.end - self.begin) if self.begin and self.end else 0.0
+        return {'mode': 'fixed',
+                'initial': self.initial,
+                'final': self.limit,
+                'peak_running': self.peak_running,
+                'mean_running': (round(self.running_time / wall, 3)
+                                 if wall else None),
+                'items': self.items,
+                'wall': round(wall, 3),
+                'throughput': round(self.items / wall, 3) if wall else None}
+
+
+class AdaptiveLimit(FixedLimit):
+    """Concurrency limit adapted to the master load and node latency
+
+    The limit grows by half until the first back-off and by a tenth
+    afterwards, once per interval while it is saturated and while the
+    1-minute load average per CPU is below max_load, the available memory
+    is above min_memory_mb and the moving average of the item latency
+    stays within latency_factor of the median latency of the first items.
+    When any of those degrade the limit is reduced by a quarter, at most
+    once per cooldown seconds since the load average reacts with a delay.
+    """
+
+    def __init__(self, initial=None, minimum=2, maximum=200, max_load=1.0,
+                 latency_factor=2.0, min_memory_mb=256, interval=1.0,
+                 cooldown=5.0):
+        if initial is None:
+            initial = 2 * multiprocessing.cpu_count()
+        initial = max(minimum, min(maximum, initial))
+        super(AdaptiveLimit, self).__init__(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_load = max_load
+        self.latency_factor = latency_factor
+        self.min_memory_mb = min_memory_mb
+        self.interval = interval
+        self.cooldown = cooldown
+        self.peak = initial
+        self.latency = None
+        self.baseline = None
+        self.samples = []
+        self.last_increase = 0.0
+        self.last_decrease = 0.0
+        self.adjustments = []
+        # optional function returning the idle time of an item from its
+        # result, excluded from the latency
+        self.idle_time = None
+
+    def finished(self, wall, result=None):
+        super(AdaptiveLimit, self).finished(wall)
+        if self.idle_time and result is not None:
+            # time spent waiting on purpose is not a sign of overload
+            wall -= self.idle_time(result)
+        if self.latency is None:
+            self.latency = wall
+        else:
+            self.latency += LATENCY_ALPHA * (wall - self.latency)
+        if self.baseline is None:
+            # the median latency of the first items, which ran at the
+            # initial concurrency, is the reference for the rest of the run
+            self.samples.append(wall)
+            if len(self.samples) == BASELINE_SAMPLES:
+                self.baseline = sorted(self.samples)[len(self.samples) // 2]
+
+    def _degraded(self):
+        load = _load_per_cpu()
+        if load is not None and load > self.max_load:
+            return 'load %.2f per cpu' % load
+        memory = _available_memory_mb()
+        if memory is not None and memory < self.min_memory_mb:
+            return 'available memory %d MB' % memory
+        if (self.baseline and
+                self.latency > self.latency_factor * self.baseline):
+            return 'latency %.2fs, baseline %.2fs' % (self.latency,
+                                                      self.baseline)
+
+    def _set(self, limit, reason):
+        logger.debug('concurrency limit %d -> %d: %s' %
+                     (self.limit, limit, reason))
+        self.limit = limit
+        self.peak = max(self.peak, limit)
+        if len(self.adjustments) < MAX_ADJUSTMENTS:
+            self.adjustments.append(
+                {'time': round(time.time() - self.begin, 3),
+                 'limit': limit,
+                 'reason': reason})
+
+    def update(self, running):
+        super(AdaptiveLimit, self).update(running)
+        now = time.time()
+        if self.begin is None or now - self.last_increase < self.interval:
+            return
+        reason = self._degraded()
+        if reason:
+            if (self.limit > self.minimum and
+                    now - self.last_decrease >= self.cooldown):
+                self._set(max(self.minimum, self.limit * 3 // 4), reason)
+                self.last_decrease = now
+        elif running >= self.limit and self.limit < self.maximum:
+            # grow fast until the first back-off, carefully afterwards
+            step = self.limit // (10 if self.last_decrease else 2)
+            step = max(1, step)
+            self._set(min(self.maximum, self.limit + step), 'saturated')
+        else:
+            return
+        self.last_increase = now
+
+    def summary(self):
+        result = super(AdaptiveLimit, self).summary()
+        result.update({'mode': 'adaptive',
+                       'minimum': self.minimum,
+                       'maximum': self.maximum,
+                       'peak': self.peak,
+                       'latency': self.latency,
+                       'baseline_latency': self.baseline,
+                       'adjustments': self.adjustments})
+        return result
+
+
+def get_limiter(maxthreads, settings=None):
+    """Returns a limiter for a maxthreads config value
+
+    :param maxthreads: number of parallel items, or 'auto'
+    :param settings: dict of AdaptiveLimit arguments for 'auto'
+    """
+    if str(maxthreads) == 'auto':
+        return AdaptiveLimit(**(settings or {}))
+    return FixedLimit(max(1, int(maxthreads)))
+
+
+class IOBudget(object):
+    """Limits how many nodes of a group run heavy scripts at the same time
+
+    Groups are environments (per_cluster), roles (per_role) and lists of
+    node ids (groups), each with a cross-process semaphore shared by the
+    node processes of run_batch. A node acquires the semaphores of all its
+    groups in the same global order, so nodes of overlapping groups cannot
+    deadlock.
+    """
+
+    def __init__(self, settings=None):
+        settings = settings or {}
+        self.scripts = set(settings.get('scripts') or [])
+        self.per_cluster = settings.get('per_cluster') or 0
+        self.per_role = settings.get('per_role') or {}
+        self.groups = settings.get('groups') or []
+        self.semaphores = {}
+
+    @property
+    def enabled(self):
+        return bool(self.scripts and
+                    (self.per_cluster or any(self.per_role.values()) or
+                     any(g.get('limit') for g in self.groups)))
+
+    def node_groups(self, node):
+        """Returns sorted [(group, limit), ...] of a node"""
+        groups = []
+        if self.per_cluster:
+            groups.append((('cluster', node.cluster), self.per_cluster))
+        for role, limit in self.per_role.items():
+            if limit and role in node.roles:
+                groups.append((('role', role), limit))
+        for i, group in enumerate(self.groups):
+            if group.get('limit') and node.id in group.get('nodes', []):
+                groups.append((('group', i), group['limit']))
+        return sorted(groups)
+
+    def locks(self, node):
+        """Returns the semaphores a node holds while running heavy scripts,
+        must be called before node processes are started"""
+        locks = []
+        for group, limit in self.node_groups(node):
+            if group not in self.semaphores:
+                self.semaphores[group] = multiprocessing.BoundedSemaphore(
+                    limit)
+            locks.append(self.semaphores[group])
+        return locks
+
+
+@contextlib.contextmanager
+def hold(locks):
+    """Acquires locks in order and releases them on exit, yields the time
+    spent waiting for them"""
+    started = time.time()
+    acquired = []
+    try:
+        for lock in locks:
+            lock.acquire()
+            acquired.append(lock)
+        yield time.time() - started
+    finally:
+        for lock in reversed(acquired):
+            lock.release()
+
+
+def load_durations(filename):
+    """Returns {node id: seconds} saved by save_durations, {} if missing"""
+    try:
+        with open(filename, 'r') as f:
+            return dict((int(k), v) for k, v in json.load(f).items())
+    except (IOError, ValueError) as e:
+        logger.debug('no previous durations in %s: %s' % (filename, e))
+        return {}
+
+
+def save_durations(filename, nodes):
+    """Saves the collection time of nodes, without I/O budget waits,
+    merged with the durations of nodes not collected this time"""
+    durations = load_durations(filename)
+    for node in nodes:
+        timings = getattr(node, 'timings', None)
+        # partially resumed collection times are not representative
+        if timings and not timings.get('resumed'):
+            durations[node.id] = timings['wall'] - timings.get('io_wait', 0)
+    try:
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(filename, 'w') as f:
+            json.dump(durations, f, indent=2, sort_keys=True)
+    except (IOError, OSError) as e:
+        logger.warning('cannot save node durations to %s: %s' %
+                       (filename, e))
+
+
+def longest_first(nodes, durations=None, role_weights=None):
+    """Orders nodes by predicted collection time, longest first
+
+    The prediction is the duration of the node in the previous run. Nodes
+    without one get the mean duration of known nodes with the same roles,
+    or the longest known duration if there are none, so that they are not
+    left for the end. Without any durations nodes are ordered by the
+    highest weight of their roles (1 for roles without a weight).
+    """
+    durations = durations or {}
+    role_weights = role_weights or {}
+    by_roles = {}
+    for node in nodes:
+        if node.id in durations:
+            by_roles.setdefault(tuple(sorted(node.roles)), []).append(
+                durations[node.id])
+    longest = max(durations.values()) if durations else None
+
+    def predict(node):
+        weight = max([role_weights.get(r, 1) for r in node.roles] or [1])
+        if node.id in durations:
+            duration = durations[node.id]
+        else:
+            known = by_roles.get(tuple(sorted(node.roles)))
+            duration = sum(known) / len(known) if known else longest
+        return (duration, weight)
+
+    return sorted(nodes, key=predict, reverse=True)
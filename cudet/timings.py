@@ -0,0 +1,86 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Per-phase timing and resource usage instrumentation
+"""
+
+import contextlib
+import datetime
+import json
+import logging
+import platform
+import resource
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def _usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'wall': time.time(),
+            'cpu_user': own.ru_utime,
+            'cpu_system': own.ru_stime,
+            'children_cpu_user': children.ru_utime,
+            'children_cpu_system': children.ru_stime,
+            # peak values so far, in kilobytes on Linux
+            'peak_rss_kb': own.ru_maxrss,
+            'children_peak_rss_kb': children.ru_maxrss}
+
+
+class Timings(object):
+    """Collects wall/CPU time and peak RSS of run phases, per-node
+    collection timings and the collection concurrency summary, exported as
+    a JSON summary"""
+
+    def __init__(self):
+        self.started = datetime.datetime.now().strftime('%F %H:%M:%S')
+        self.phases = []
+        self.nodes = {}
+        self.concurrency = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        before = _usage()
+        try:
+            yield
+        finally:
+            after = _usage()
+            result = {'name': name}
+            for k in before:
+                if k.endswith('_kb'):
+                    result[k] = after[k]
+                else:
+                    result[k] = round(after[k] - before[k], 6)
+            self.phases.append(result)
+            logger.debug('phase %s: %.3fs wall' % (name, result['wall']))
+
+    def add_node(self, node):
+        timings = getattr(node, 'timings', None)
+        if timings:
+            self.nodes[str(node.id)] = dict(timings, ip=node.ip,
+                                            roles=node.roles)
+
+    def summary(self):
+        return {'started': self.started,
+                'python': platform.python_version(),
+                'phases': self.phases,
+                'nodes': self.nodes,
+                'concurrency': self.concurrency}
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
@@ -13,6 +13,9 @@
 #    under the License.
 
 import contextlib
+import gzip
+import hashlib
+import io
 import json
 import logging
 import multiprocessing
@@ -22,14 +25,32 @@ import subprocess
 import sys
 import tempfile
 import threading
-import yaml
+import time
+import zlib
 
 from cudet import exceptions
 from cudet import flock
+import six
+from six.moves import queue
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 logger = logging.getLogger(__name__)
 
+# seconds between checks for finished processes in limited run_batch
+POLL_INTERVAL = 0.05
+# file name suffixes of compressed node outputs
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+# characters of the command, stdin, stdout and stderr in launch_cmd debug
+# messages
+DEBUG_PREVIEW = 1024
+# seconds run_with_lock waits for another process holding the lock
+LOCK_WAIT = 3600
+
 
 def interrupt_wrapper(f):
     def wrapper(*args, **kwargs):
@@ -37,7 +58,7 @@ def interrupt_wrapper(f):
             f(*args, **kwargs)
         except KeyboardInterrupt:
             logger.warning('Interrupted, exiting.')
-        except exceptions.AllNodesFiltered as e:
+        except (exceptions.AllNodesFiltered, exceptions.LockUnavailable) as e:
             logger.warning(e.message)
         except Exception as e:
             logger.error('Error: %s' % e, exc_info=True)
@@ -50,16 +71,87 @@ def interrupt_wrapper(f):
     return wrapper
 
 
+def _lock_name(name, key=None):
+    if key is None:
+        return name
+    if isinstance(key, six.text_type):
+        key = key.encode('utf-8')
+    return '%s_%s' % (name, hashlib.md5(key).hexdigest())
+
+
+def _lock_file(name):
+    return os.path.join(tempfile.gettempdir(), 'cudet_%s.lock' % name)
+
+
+def _lock_info_file(name):
+    return os.path.join(tempfile.gettempdir(), 'cudet_%s.json' % name)
+
+
+def lock_holder(name, key=None):
+    """
+    Returns {'pid': ..., 'started': ...} of a run_with_lock function
+    running in another process with the same lock_key ({} if not known),
+    None if it is not running
+    """
+    name = _lock_name(name, key)
+    lock = flock.FLock(_lock_file(name))
+    if lock.lock():
+        lock.unlock()
+        return None
+    try:
+        with open(_lock_info_file(name), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
 def run_with_lock(f):
+    """
+    Runs f holding a lock shared by all cudet processes calling it with the
+    same lock_key. If another process holds it, waits until that run
+    finishes and calls f with waited_for={'pid': ..., 'started': ...} of it
+    ({} if not known), so that f can reuse its results instead of doing the
+    same work again.
+
+    lock_key and lock_wait are keyword arguments of the wrapper which are
+    not passed to f. Processes with different keys, for example working on
+    different directories, do not wait for each other. The wait is limited
+    to lock_wait seconds (LOCK_WAIT by default), then
+    exceptions.LockUnavailable is raised, as well as if the lock file is
+    not writable.
+    """
     def wrapper(*args, **kwargs):
-        lock = flock.FLock(os.path.join(tempfile.gettempdir(),
-                                        'cudet_%s.lock' % f.__name__))
+        lock_key = kwargs.pop('lock_key', None)
+        lock_wait = kwargs.pop('lock_wait', None) or LOCK_WAIT
+        name = _lock_name(f.__name__, lock_key)
+        lock = flock.FLock(_lock_file(name))
+        info_file = _lock_info_file(name)
         if not lock.lock():
-            logger.warning('Unable to obtain lock, skipping "%s"' %
-                           f.__name__)
-            return ''
-        f(*args, **kwargs)
-        lock.unlock()
+            if (os.path.exists(lock.lockfile) and
+                    not os.access(lock.lockfile, os.W_OK)):
+                raise exceptions.LockUnavailable(
+                    'cannot run "%s", no write access to the lock file %s' %
+                    (f.__name__, lock.lockfile))
+            info = lock_holder(f.__name__, lock_key) or {}
+            logger.warning('"%s" is running in process %s, waiting for it '
+                           'to finish' % (f.__name__, info.get('pid', '?')))
+            if not lock.lock(wait=lock_wait):
+                raise exceptions.LockUnavailable(
+                    'cannot run "%s", the lock file %s is held by process %s '
+                    'for more than %s seconds' %
+                    (f.__name__, lock.lockfile, info.get('pid', '?'),
+                     lock_wait))
+            kwargs['waited_for'] = info
+        try:
+            write_atomic(info_file, json.dumps({'pid': os.getpid(),
+                                                'started': time.time()}))
+            return f(*args, **kwargs)
+        finally:
+            try:
+                os.remove(info_file)
+            except OSError:
+                pass
+            lock.unlock()
     return wrapper
 
 
@@ -99,31 +191,72 @@ class SemaphoreProcess(multiprocessing.Process):
             self.logger.debug('semaphore released')
 
 
-def run_batch(item_list, maxthreads, dict_result=False):
+def run_batch(item_list, maxthreads, dict_result=False, limiter=None):
+    """Runs item targets in parallel processes
+
+    :param maxthreads: maximum number of running processes
+    :param limiter: optional cudet.scheduler limiter, its "limit" attribute
+                    is re-read before every process start and replaces
+                    maxthreads
+    """
     def cleanup():
         logger.debug('cleanup processes')
         for run_item in item_list:
             if run_item.process:
                 run_item.process.terminate()
-    semaphore = multiprocessing.BoundedSemaphore(maxthreads)
+
+    def start(run_item, semaphore):
+        run_item.queue = multiprocessing.Queue()
+        p = SemaphoreProcess(target=run_item.target,
+                             semaphore=semaphore,
+                             args=run_item.args,
+                             queue=run_item.queue)
+        run_item.process = p
+        run_item.started = time.time()
+        p.start()
+
+    def collect(run_item, result):
+        run_item.result = result
+        if isinstance(run_item.result, Exception):
+            logger.critical('%s, exiting' % run_item.result)
+            cleanup()
+            sys.exit(42)
+        run_item.process.join()
+        run_item.process = None
+
     try:
-        for run_item in item_list:
-            semaphore.acquire(True)
-            run_item.queue = multiprocessing.Queue()
-            p = SemaphoreProcess(target=run_item.target,
-                                 semaphore=semaphore,
-                                 args=run_item.args,
-                                 queue=run_item.queue)
-            run_item.process = p
-            p.start()
-        for run_item in item_list:
-            run_item.result = run_item.queue.get()
-            if isinstance(run_item.result, Exception):
-                logger.critical('%s, exiting' % run_item.result)
-                cleanup()
-                sys.exit(42)
-            run_item.process.join()
-            run_item.process = None
+        if limiter is None:
+            semaphore = multiprocessing.BoundedSemaphore(maxthreads)
+            for run_item in item_list:
+                semaphore.acquire(True)
+                start(run_item, semaphore)
+            for run_item in item_list:
+                collect(run_item, run_item.queue.get())
+        else:
+            # processes release the semaphore when done, the limit is
+            # enforced here by counting running items
+            semaphore = multiprocessing.Semaphore(0)
+            pending = list(item_list)
+            pending.reverse()
+            running = []
+            while pending or running:
+                for run_item in list(running):
+                    try:
+                        result = run_item.queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    collect(run_item, result)
+                    running.remove(run_item)
+                    limiter.finished(time.time() - run_item.started,
+                                     result)
+                limiter.update(len(running))
+                while pending and len(running) < limiter.limit:
+                    run_item = pending.pop()
+                    limiter.started()
+                    start(run_item, semaphore)
+                    running.append(run_item)
+                if running:
+                    time.sleep(POLL_INTERVAL)
         if dict_result:
             result = {}
             for run_item in item_list:
@@ -156,6 +289,7 @@ def load_yaml_file(filename):
     """
     Loads yaml data from file
     """
+    import yaml
     try:
         with open(filename, 'r') as f:
             return yaml.load(f)
@@ -185,7 +319,136 @@ def mdir(directory):
             sys.exit(3)
 
 
-def launch_cmd(cmd, timeout, input=None, ok_codes=None):
+def write_atomic(filename, data):
+    """
+    Writes data to a temporary file next to filename and renames it over
+    filename, so that the file is either complete or not updated at all
+    """
+    tmp = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def compression_method(method):
+    """
+    Returns the compression method to use for an outputs_compression
+    config value, None for no compression
+    """
+    if not method:
+        return None
+    if method == 'zstd' and zstandard is None:
+        logger.warning('zstandard module is not available, '
+                       'using gzip for outputs compression')
+        return 'gzip'
+    if method not in COMPRESSION_SUFFIXES:
+        logger.warning('unknown outputs compression %s, outputs will not '
+                       'be compressed' % method)
+        return None
+    return method
+
+
+def compress(data, method):
+    """
+    Compresses data with a method returned by compression_method
+    """
+    if method == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        return compressor.compress(data) + compressor.flush()
+    if method == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def open_output(filename):
+    """
+    Opens a node output for reading, compressed outputs (by file name
+    suffix) are decompressed while reading
+    """
+    if filename.endswith(COMPRESSION_SUFFIXES['gzip']):
+        return io.BufferedReader(gzip.open(filename, 'rb'))
+    if filename.endswith(COMPRESSION_SUFFIXES['zstd']):
+        if zstandard is None:
+            raise IOError('zstandard module is required to read %s' %
+                          filename)
+        decompressor = zstandard.ZstdDecompressor()
+        return io.BufferedReader(
+            decompressor.stream_reader(open(filename, 'rb')))
+    return open(filename, 'r')
+
+
+def output_empty(filename):
+    """
+    Checks if a node output, possibly compressed, has no content
+    """
+    if os.stat(filename).st_size == 0:
+        return True
+    if filename.endswith(tuple(COMPRESSION_SUFFIXES.values())):
+        with open_output(filename) as f:
+            return not f.read(1)
+    return False
+
+
+def gunzip(data):
+    """
+    Decompresses gzip data, of a truncated stream (for example of a command
+    killed by timeout) returns as much as can be decompressed
+    """
+    if not data:
+        return data
+    try:
+        return zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(data)
+    except zlib.error as e:
+        logger.error('cannot decompress command output: %s' % e)
+        return ''
+
+
+def _preview(data, size):
+    """Returns the beginning of a command input or output for debug
+    messages"""
+    if not data:
+        return data
+    more = len(data) - size
+    data = data[:size]
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', 'replace')
+    if more > 0:
+        data += u'... (%d more)' % more
+    return data
+
+
+def _write_transcript(filename, cmd, code, input, outs, errs):
+    """Appends the full input and outputs of a command to a file"""
+    def text(data):
+        if data is None:
+            return ''
+        return data.encode('utf-8') if not isinstance(data, bytes) else data
+
+    try:
+        mdir(os.path.dirname(filename))
+        with open(filename, 'ab') as f:
+            f.write('=== %s exit code %s\n%s\n' % (
+                time.strftime('%F %T'), code, text(cmd)))
+            for name, data in (('stdin', input), ('stdout', outs),
+                               ('stderr', errs)):
+                f.write('--- %s\n%s\n' % (name, text(data)))
+    except (IOError, OSError) as e:
+        logger.warning('cannot write transcript %s: %s' % (filename, e))
+
+
+def launch_cmd(cmd, timeout, input=None, ok_codes=None, decompress=False,
+               preview=DEBUG_PREVIEW, transcript=None):
+    """
+    :param preview: characters of the command, input and outputs in the
+                    debug message, which is only built if debug messages
+                    are enabled
+    :param transcript: file the command and its full input and outputs are
+                       appended to
+    """
     def _timeout_terminate(pid):
         try:
             os.kill(pid, 15)
@@ -193,7 +456,7 @@ def launch_cmd(cmd, timeout, input=None, ok_codes=None):
         except:
             pass
 
-    logger.info('launching cmd %s' % cmd)
+    logger.info('launching cmd %s', cmd)
     p = subprocess.Popen(cmd,
                          shell=True,
                          stdin=subprocess.PIPE,
@@ -204,6 +467,8 @@ def launch_cmd(cmd, timeout, input=None, ok_codes=None):
         timeout_killer = threading.Timer(timeout, _timeout_terminate, [p.pid])
         timeout_killer.start()
         outs, errs = p.communicate(input=input)
+        if decompress:
+            outs = gunzip(outs)
         outs = outs.decode('utf-8')
         errs = errs.decode('utf-8')
         errs = errs.rstrip('\n')
@@ -214,25 +479,43 @@ def launch_cmd(cmd, timeout, input=None, ok_codes=None):
             pass
         p.stdin = None
         outs, errs = p.communicate()
+        if decompress:
+            outs = gunzip(outs)
         outs = outs.decode('utf-8')
         errs = errs.decode('utf-8')
         errs = errs.rstrip('\n')
     finally:
         if timeout_killer:
             timeout_killer.cancel()
-        input = input.decode('utf-8') if input else None
-        logger.debug(('___command: %s\n'
-                      '_exit_code: %s\n'
-                      '_____stdin: %s\n'
-                      '____stdout: %s\n'
-                      '____stderr: %s') % (cmd, p.returncode, input, outs,
-                                           errs))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('___command: %s\n'
+                         '_exit_code: %s\n'
+                         '_____stdin: %s\n'
+                         '____stdout: %s\n'
+                         '____stderr: %s', _preview(cmd, preview),
+                         p.returncode,
+                         _preview(input, preview), _preview(outs, preview),
+                         _preview(errs, preview))
+        if transcript:
+            _write_transcript(transcript, cmd, p.returncode, input, outs,
+                              errs)
     return outs, errs, p.returncode
 
 
 def ssh_node(ip, command='', ssh_opts=None, env_vars=None, timeout=15,
              filename=None, inputfile=None, outputfile=None,
-             ok_codes=None, input=None, prefix=None):
+             ok_codes=None, input=None, prefix=None, compress=False,
+             preview=DEBUG_PREVIEW, transcript=None):
+    """
+    Runs a command or a script (filename) on a node, locally for loopback
+    addresses
+
+    :param compress: gzip the output of a script on the node and decompress
+                     it here, to save bandwidth for large outputs - ignored
+                     for commands, local runs and outputfile
+    :param preview: see launch_cmd
+    :param transcript: see launch_cmd
+    """
     if ssh_opts is None:
         ssh_opts = ''
     if env_vars is None:
@@ -245,6 +528,7 @@ def ssh_node(ip, command='', ssh_opts=None, env_vars=None, timeout=15,
         env_vars = ' '.join(env_vars)
     if (ip in ['localhost', '127.0.0.1']) or ip.startswith('127.'):
         logger.info("skip ssh")
+        compress = False
         bstr = "%s timeout '%s' bash -c " % (
                env_vars, timeout)
     else:
@@ -252,13 +536,21 @@ def ssh_node(ip, command='', ssh_opts=None, env_vars=None, timeout=15,
         bstr = "timeout '%s' ssh -t -T %s '%s' '%s' " % (
                timeout, ssh_opts, ip, env_vars)
     if filename is None:
+        compress = False
         cmd = '%s %s' % (bstr, pipes.quote(prefix + ' ' + command))
         if inputfile is not None:
             '''inputfile and stdin will not work together,
             give priority to inputfile'''
             input = None
             cmd = "%s < '%s'" % (cmd, inputfile)
+    elif compress and outputfile is None:
+        # exit code of the script, not of gzip
+        cmd = ("%s'%s bash -c \"bash -s | gzip -c; "
+               "exit \\${PIPESTATUS[0]}\"' < '%s'" % (bstr, prefix,
+                                                        filename))
+        logger.info("inputfile selected, compressed, cmd: %s" % cmd)
     else:
+        compress = False
         cmd = "%s'%s bash -s' < '%s'" % (bstr, prefix, filename)
         logger.info("inputfile selected, cmd: %s" % cmd)
     if outputfile is not None:
@@ -266,7 +558,9 @@ def ssh_node(ip, command='', ssh_opts=None, env_vars=None, timeout=15,
     cmd = ("input=\"$(cat | xxd -p)\"; trap 'kill $pid' 15; " +
            "trap 'kill $pid' 2; echo -n \"$input\" | xxd -r -p | " + cmd +
            ' &:; pid=$!; wait $!')
-    return launch_cmd(cmd, timeout, input=input, ok_codes=ok_codes)
+    return launch_cmd(cmd, timeout, input=input, ok_codes=ok_codes,
+                      decompress=compress, preview=preview,
+                      transcript=transcript)
 
 
 # wrap non-list into list
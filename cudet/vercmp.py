@@ -160,11 +160,11 @@ def deb_vercmp(a, b):
             return b_newer
         b = b[2:]
 
-    a_parts = re.match('^([^-].+?)?(?:-([^-]+))?$', a)
+    a_parts = re.match('^([^-].*?)?(?:-([^-]+))?$', a)
     a_version = a_revision = None
     if a_parts:
         a_version, a_revision = a_parts.groups()
-    b_parts = re.match('^([^-].+?)?(?:-([^-]+))?$', b)
+    b_parts = re.match('^([^-].*?)?(?:-([^-]+))?$', b)
     b_version = b_revision = None
     if b_parts:
         b_version, b_revision = b_parts.groups()
@@ -0,0 +1,338 @@
+#!/usr/bin/python
+
+import argparse
+import bz2
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import stat
+import struct
+import subprocess
+import sys
+import tarfile
+import threading
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# top-level directories which are not verified on nodes
+excluded_dirs = ['etc', 'root', 'home', 'mnt', 'proc', 'sys', 'tmp', 'dev',
+                 'run']
+
+CHUNK = 1024 * 1024
+
+
+class LimitedReader(object):
+    '''Read-only view of `size` bytes of a file object starting at its
+    current position - used to stream archive members without copying them.
+    '''
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.left = size
+
+    def read(self, n=-1):
+        if self.left <= 0:
+            return b''
+        if n < 0 or n > self.left:
+            n = self.left
+        data = self.fileobj.read(n)
+        self.left -= len(data)
+        return data
+
+
+class DecompressingReader(object):
+    '''Streaming decompression of a file object, format detected by magic.'''
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.buf = b''
+        self.pos = 0
+        self.eof = False
+        self.proc = None
+        self.head = fileobj.read(6)
+        if self.head.startswith(b'\x1f\x8b'):
+            self.d = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        elif self.head.startswith(b'BZh'):
+            self.d = bz2.BZ2Decompressor()
+        elif self.head.startswith(b'\xfd7zXZ'):
+            if lzma is not None:
+                self.d = lzma.LZMADecompressor()
+            else:
+                self._xz_subprocess()
+        else:
+            # uncompressed payload
+            self.d = None
+
+    def _xz_subprocess(self):
+        # no lzma module in this python - stream through xz instead
+        self.proc = subprocess.Popen(['xz', '-dc'], stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE)
+
+        def feed(src, dst, head):
+            try:
+                dst.write(head)
+                while True:
+                    data = src.read(CHUNK)
+                    if not data:
+                        break
+                    dst.write(data)
+            except IOError:
+                pass
+            finally:
+                dst.close()
+
+        t = threading.Thread(target=feed, args=(self.fileobj,
+                                                self.proc.stdin,
+                                                self.head))
+        t.daemon = True
+        t.start()
+
+    def read(self, n=-1):
+        if self.proc:
+            return self.proc.stdout.read(n)
+        chunks = []
+        while n != 0:
+            if self.pos >= len(self.buf):
+                if self.eof:
+                    break
+                data = self.head or self.fileobj.read(CHUNK)
+                self.head = b''
+                if not data:
+                    self.eof = True
+                    continue
+                self.buf = self.d.decompress(data) if self.d else data
+                self.pos = 0
+                continue
+            left = len(self.buf) - self.pos
+            take = left if n < 0 else min(n, left)
+            chunks.append(self.buf[self.pos:self.pos + take])
+            self.pos += take
+            if n > 0:
+                n -= take
+        return b''.join(chunks)
+
+    def close(self):
+        if self.proc:
+            self.proc.stdout.close()
+            self.proc.wait()
+
+
+def excluded(path):
+    return path.lstrip('/').split('/', 1)[0] in excluded_dirs
+
+
+def normpath(name):
+    if name.startswith('./'):
+        name = name[2:]
+    return '/' + name.lstrip('/')
+
+
+def md5_stream(fileobj, size):
+    h = hashlib.md5()
+    while size > 0:
+        data = fileobj.read(min(size, CHUNK))
+        if not data:
+            break
+        h.update(data)
+        size -= len(data)
+    return h.hexdigest()
+
+
+def hash_tar(fileobj):
+    results = []
+    # md5 of every regular member, hard links refer to an earlier member
+    hashed = {}
+    tar = tarfile.open(fileobj=fileobj, mode='r|')
+    for member in tar:
+        path = normpath(member.name)
+        if member.isreg():
+            hashed[path] = md5_stream(tar.extractfile(member), member.size)
+            md5 = hashed[path]
+        elif member.islnk() and normpath(member.linkname) in hashed:
+            md5 = hashed[normpath(member.linkname)]
+        else:
+            continue
+        if not excluded(path):
+            results.append((path, md5))
+    return results
+
+
+def hash_cpio(fileobj):
+    '''Parses a "newc" cpio archive (the rpm payload format).
+
+    Hard links are stored as one entry per link, the data is in the last
+    one and all of them get its md5.
+    '''
+    def skip(n):
+        while n > 0:
+            n -= len(fileobj.read(min(n, CHUNK)))
+
+    results = []
+    # (dev, inode) -> paths of hard links whose data is not read yet
+    links = {}
+    while True:
+        header = fileobj.read(110)
+        if len(header) < 110 or header[:6] not in (b'070701', b'070702'):
+            break
+        ino = int(header[6:14], 16)
+        mode = int(header[14:22], 16)
+        nlink = int(header[38:46], 16)
+        filesize = int(header[54:62], 16)
+        dev = header[62:78]
+        namesize = int(header[94:102], 16)
+        name = fileobj.read(namesize)[:-1].decode('utf-8', 'replace')
+        skip((4 - (110 + namesize) % 4) % 4)
+        if name == 'TRAILER!!!':
+            break
+        path = normpath(name)
+        paths = [path]
+        if stat.S_ISREG(mode) and nlink > 1:
+            paths = links.setdefault((dev, ino), [])
+            paths.append(path)
+            if not filesize:
+                # data follows with the last link
+                continue
+            del links[(dev, ino)]
+        paths = [p for p in paths if not excluded(p)]
+        if stat.S_ISREG(mode) and paths:
+            md5 = md5_stream(fileobj, filesize)
+            results.extend((p, md5) for p in paths)
+        else:
+            skip(filesize)
+        skip((4 - filesize % 4) % 4)
+    # hard links of an empty file
+    empty = hashlib.md5().hexdigest()
+    for paths in links.values():
+        results.extend((p, empty) for p in paths if not excluded(p))
+    return results
+
+
+def hash_deb(f):
+    if f.read(8) != b'!<arch>\n':
+        raise ValueError('not an ar archive')
+    while True:
+        header = f.read(60)
+        if len(header) < 60:
+            raise ValueError('no data member found')
+        name = header[:16].decode('ascii').strip().rstrip('/')
+        size = int(header[48:58])
+        if name.startswith('data.tar'):
+            stream = DecompressingReader(LimitedReader(f, size))
+            try:
+                return hash_tar(stream)
+            finally:
+                stream.close()
+        f.seek(size + size % 2, os.SEEK_CUR)
+
+
+def hash_rpm(f):
+    def skip_header(align):
+        magic, _, count, size = struct.unpack('>4sIII', f.read(16))
+        if magic[:3] != b'\x8e\xad\xe8':
+            raise ValueError('bad rpm header magic')
+        length = count * 16 + size
+        if align:
+            length += (8 - length % 8) % 8
+        f.seek(length, os.SEEK_CUR)
+
+    if f.read(4) != b'\xed\xab\xee\xdb':
+        raise ValueError('not an rpm package')
+    f.seek(96)
+    # signature header is 8-byte aligned, main header is not
+    skip_header(align=True)
+    skip_header(align=False)
+    stream = DecompressingReader(f)
+    try:
+        return hash_cpio(stream)
+    finally:
+        stream.close()
+
+
+def hash_package(path):
+    '''Process pool worker, returns (path, [(file, md5), ...], error).'''
+    try:
+        with open(path, 'rb') as f:
+            if path.endswith('.deb'):
+                return path, hash_deb(f), None
+            return path, hash_rpm(f), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def find_packages(dirs):
+    for d in dirs:
+        for root, _, files in os.walk(d):
+            for f in sorted(files):
+                if f.endswith('.deb') or f.endswith('.rpm'):
+                    yield os.path.join(root, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=('Build an md5 database from .deb and .rpm packages, '
+                     'keyed by ids from a versions database'))
+    parser.add_argument('-v', '--versions-db', required=True,
+                        help=('Mandatory. Path to a versions database built '
+                              'by generate-db.py, used to map package '
+                              'filenames to version ids.'))
+    parser.add_argument('-o', '--output', required=True,
+                        help=('Mandatory. Path to the md5 database, created '
+                              'if missing, existing rows for re-hashed '
+                              'versions are replaced.'))
+    parser.add_argument('-p', '--processes', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help=('Optional. Number of hashing processes '
+                              '(default: number of CPUs).'))
+    parser.add_argument('dirs', nargs='+',
+                        help='Directories to scan for packages, recursively.')
+    args = parser.parse_args(argv[1:])
+
+    vdb = sqlite3.connect(args.versions_db)
+    # the lowest id is the first (GA) occurrence of a filename
+    ids = dict(vdb.execute('''
+        SELECT package_filename, MIN(id) FROM versions
+        GROUP BY package_filename
+        ''').fetchall())
+    vdb.close()
+
+    db = sqlite3.connect(args.output)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS md5
+        (
+            version_id INTEGER,
+            path TEXT,
+            md5 TEXT
+        )''')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS md5_version_id_path
+        ON md5 (version_id, path)''')
+
+    packages = []
+    for path in find_packages(args.dirs):
+        if os.path.basename(path) in ids:
+            packages.append(path)
+        else:
+            print('problem with finding %s in the database'
+                  % (os.path.basename(path),))
+    pool = multiprocessing.Pool(args.processes)
+    try:
+        for path, md5s, error in pool.imap_unordered(hash_package, packages):
+            if error:
+                sys.stderr.write('Error: %s: %s\n' % (path, error))
+                continue
+            version_id = ids[os.path.basename(path)]
+            db.execute('DELETE FROM md5 WHERE version_id = ?', (version_id,))
+            db.executemany('INSERT INTO md5 (version_id, path, md5) '
+                           'VALUES (?,?,?)',
+                           [(version_id, p, m) for p, m in md5s])
+    finally:
+        pool.terminate()
+    db.commit()
+    db.close()
+    return 0
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
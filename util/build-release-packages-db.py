@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+import versionsdb
+
+
+def scan_package(path):
+    '''Process pool worker, returns (path, os, name, version, error).'''
+    try:
+        with open(path, 'rb') as f:
+            if path.endswith('.deb'):
+                return (path, 'ubuntu') + versionsdb.read_deb_control(f) + \
+                    (None,)
+            return (path, 'centos') + versionsdb.read_rpm_header(f) + (None,)
+    except Exception as e:
+        return path, None, None, None, str(e)
+
+
+def find_packages(dirs):
+    for d in dirs:
+        for root, _, files in os.walk(d):
+            for f in sorted(files):
+                if f.endswith('.src.rpm'):
+                    continue
+                if f.endswith('.deb') or f.endswith('.rpm'):
+                    yield d, os.path.join(root, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=('Add packages of a release ISO (or any package tree) '
+                     'to a versions database, reading rpm headers and deb '
+                     'control members directly'))
+    parser.add_argument('-r', '--release', required=True,
+                        help='Mandatory. Release version (example: 6.1).')
+    parser.add_argument('-o', '--output', required=True,
+                        help=('Mandatory. Path to the versions database, '
+                              'created if missing. May contain an {os} '
+                              'placeholder, for example '
+                              'db/versions/6.1/{os}.sqlite.'))
+    parser.add_argument('-n', '--mu-number', type=int, default=0,
+                        help=('Optional. Integer ID of the MU update, 0 '
+                              '(default) for a release ISO.'))
+    parser.add_argument('-j', '--job-id', type=int, default=0,
+                        help='Optional. ID of the Jenkins job.')
+    parser.add_argument('-p', '--processes', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help=('Optional. Number of scanning processes '
+                              '(default: number of CPUs).'))
+    parser.add_argument('dirs', nargs='*', default=['/var/www/nailgun'],
+                        help=('Directories to scan for packages, '
+                              'recursively (default: /var/www/nailgun).'))
+    args = parser.parse_args(argv[1:])
+
+    found = list(find_packages(args.dirs))
+    roots = dict((path, root) for root, path in found)
+    # rows to add per output database, in scan order
+    outputs = {}
+    errors = 0
+    pool = multiprocessing.Pool(args.processes)
+    try:
+        for path, os_platform, name, version, error in pool.imap(
+                scan_package, [path for _, path in found], chunksize=16):
+            if error:
+                sys.stderr.write('Error: %s: %s\n' % (path, error))
+                errors += 1
+                continue
+            output = args.output.format(os=os_platform)
+            outputs.setdefault(output, []).append(
+                (roots[path], os_platform, name, version,
+                 os.path.basename(path)))
+    finally:
+        pool.terminate()
+
+    for output, rows in sorted(outputs.items()):
+        db = versionsdb.connect(output)
+        _, known = versionsdb.load_index(db)
+        sources = {}
+        new = []
+        for root, os_platform, name, version, filename in rows:
+            key = (args.release, args.mu_number, os_platform, name, version,
+                   filename)
+            if key in known:
+                continue
+            known.add(key)
+            if root not in sources:
+                sources[root] = versionsdb.source_id(
+                    db, 'file://' + os.path.abspath(root))
+            new.append((sources[root], args.job_id) + key)
+        versionsdb.insert(db, new)
+        db.commit()
+        db.close()
+        print('%s: %d packages added, %d already known' %
+              (output, len(new), len(rows) - len(new)))
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
@@ -5,11 +5,10 @@ import argparse
 import urllib2
 import sqlite3
 import os
-import bz2
-import zlib
-import tempfile
-import xml.etree.ElementTree as ET
-from StringIO import StringIO
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import versionsdb
 
 releases = ['5.1',
             '5.1.1',
@@ -23,8 +22,35 @@ systems = ['ubuntu',
            'centos',
           ]
 
-def main(argv=None):
 
+# Fetching and parsing live at module level so they can be handed to thread
+# and process pools: downloads run in a thread pool, decompression and parsing
+# in a process pool, and all sqlite writes are done by a single writer in the
+# main process. The writer consumes sources in command-line order, so "first
+# source wins" for duplicates no matter which download finishes first.
+
+
+def fetch_one(source):
+    try:
+        return source, urllib2.urlopen(source).read()
+    except Exception:
+        return source, None
+
+
+def parse_source(os_platform, source, data):
+    data = versionsdb.decompress(data, source)
+    if os_platform == 'ubuntu':
+        packages = versionsdb.packages_from_index(data)
+    elif os_platform == 'centos':
+        packages = versionsdb.packages_from_primary(
+            data, xml='.xml' in source.split('/')[-1])
+    else:
+        return []
+    # results of process pool workers are pickled, generators are not
+    return list(packages)
+
+
+def main(argv=None):
     def verify_args():
         if not args.os:
             return 'OS not specified.'
@@ -50,85 +76,35 @@ def main(argv=None):
             return 'Cannot write to the output file '+args.output
 
     def fetch(sources):
-        fetched = {}
-        for source in sources:
-            try:
-                request = urllib2.urlopen(source)
-            except Exception:
-                sys.stderr.write('Error: Could not access "%s", verify URL correctness.\n'
-                    % (str(source),))
-                sys.exit(1)
-            fetched[source] = request.read()
-        return fetched
-
-    def debs_from_source(data):
-        packages = []
-        packagedata = data.split('\n\n')
-        for pd in packagedata:
-            if len(pd) == 0:
-                continue
-            package = {}
-            lines = pd.split('\n')
-            for line in lines:
-                unpacked = line.split(': ', 1)
-                if len(unpacked) > 1:
-                    package[unpacked[0]] = unpacked[1]
-            package['Filename'] = package['Filename'].split('/')[-1]
-            packages.append(package)
-        return packages
+        '''Downloads sources in a thread pool, yields (source, data) in the
+        order the sources were specified.'''
+        pool = ThreadPool(max(1, min(len(sources), args.threads)))
+        try:
+            for source, data in pool.imap(fetch_one, sources):
+                if data is None:
+                    sys.stderr.write('Error: Could not access "%s", verify URL correctness.\n'
+                        % (str(source),))
+                    sys.exit(1)
+                yield source, data
+        finally:
+            pool.terminate()
 
-    def rpms_from_source(data, source):
-        packages = []
-        with tempfile.NamedTemporaryFile() as tf:
-            if source.endswith('.sqlite.bz2'):
-                tf.write(bz2.decompress(data))
-                tf.flush()
-                db = sqlite3.connect(tf.name)
-                dbc = db.cursor()
-                packagedata = dbc.execute('''
-                   SELECT
-                       name,
-                       epoch,
-                       version,
-                       release,
-                       location_href
-                   FROM packages
-                   ''')
-                for pd in packagedata:
-                    if pd[4].split('/')[0] != 'Packages':
-                        #ignore source rpms
-                        continue
-                    package = {}
-                    package['Package'] = pd[0]
-                    if pd[1] != '0':
-                        package['Version'] = pd[1]+':'+pd[2]+'-'+pd[3]
-                    else:
-                        package['Version'] = pd[2]+'-'+pd[3]
-                    package['Filename'] = pd[4].split('/')[-1]
-                    packages.append(package)
-                db.close()
-            elif source.endswith('xml.gz'):
-                xmldata = zlib.decompress(data, zlib.MAX_WBITS | 16)
-                xmltree = ET.iterparse(StringIO(xmldata))
-                # strip namespaces
-                for _, el in xmltree:
-                    if '}' in el.tag:
-                        el.tag = el.tag.split('}', 1)[1]
-                for pd in xmltree.root:
-                    package = {}
-                    p_ep = pd.find('version').get('epoch')
-                    p_ver = pd.find('version').get('ver')
-                    p_rel = pd.find('version').get('rel')
-                    package['Package'] = pd.findtext('name')
-                    package['Filename'] = pd.find('location').get('href').split('/')[-1]
-                    if p_ep != '0':
-                        package['Version'] = '%s:%s-%s' % (p_ep, p_ver, p_rel)
-                    else:
-                        package['Version'] = '%s-%s' % (p_ver, p_rel)
-                    packages.append(package)
-            else:
-                print('unknown format of %s' % (source,))
-        return packages
+    def parse(fetched):
+        '''Hands every fetched source to a process pool as soon as it is
+        downloaded, yields (source, packages) in the original order.'''
+        pool = multiprocessing.Pool(args.processes)
+        pending = []
+        try:
+            for source, data in fetched:
+                pending.append((source, pool.apply_async(
+                    parse_source, (args.os, source, data))))
+                while pending and pending[0][1].ready():
+                    source, result = pending.pop(0)
+                    yield source, result.get()
+            for source, result in pending:
+                yield source, result.get()
+        finally:
+            pool.terminate()
 
     def dbgen(sources, mu=0, job_id=-1):
         db = sqlite3.connect(args.output)
@@ -154,7 +130,23 @@ def main(argv=None):
                     package_version TEXT,
                     package_filename TEXT
                 )''')
-        for source, data in sources.items():
+        sources_by_id = dict(dbc.execute('''
+            SELECT id, source FROM sources
+            ''').fetchall())
+        # index of already known packages for this release/mu/os, so that
+        # duplicates are detected without a query per package
+        known = {}
+        r = dbc.execute('''
+            SELECT package_name, package_version, package_filename, source_id
+            FROM versions
+            WHERE release = ?
+                  AND mu = ?
+                  AND os = ?
+            ORDER BY id
+            ''', (args.release, mu, args.os))
+        for row in r:
+            known.setdefault(tuple(row[:3]), row[3])
+        for source, packages in sources:
             r = dbc.execute('''
                 SELECT rowid FROM sources WHERE source = ?
                 ''', (source,)).fetchall()
@@ -167,61 +159,38 @@ def main(argv=None):
                         WHERE source = ? 
                     ''', (source,)).fetchall()
             source_id = r[0][0]
-            if args.os == 'ubuntu':
-                packages = debs_from_source(data)
-            if args.os == 'centos':
-                packages = rpms_from_source(data, source)
-            for package in packages:
-                r = dbc.execute('''
-                    SELECT source_id, mu FROM versions
-                    WHERE release = ?
-                          AND mu = ?
-                          AND os = ?
-                          AND package_name = ?
-                          AND package_version = ?
-                          AND package_filename = ?
-                    ''', (args.release,
-                          mu,
-                          args.os,
-                          package['Package'],
-                          package['Version'],
-                          package['Filename']))
-                pkgs = r.fetchall()
-                if len(pkgs) > 0:
-                    found_mu = 'GA' if pkgs[0][1] == 0 else 'MU%s' % (pkgs[0][1])
-                    r = dbc.execute('''
-                        SELECT source FROM sources
-                        WHERE id = ?
-                        ''', (pkgs[0][0],))
-                    found_source = r.fetchone()[0]
+            sources_by_id[source_id] = source
+            rows = []
+            for key in packages:
+                if key in known:
+                    found_mu = 'GA' if int(mu) == 0 else 'MU%s' % (mu,)
                     print('  Duplicate package in %s\n    %s %s\n'
                           '    already provided by %s (%s)\n  Skipping...' % (
                               source,
-                              package['Package'],
-                              package['Version'],
-                              found_source,
+                              key[0],
+                              key[1],
+                              sources_by_id[known[key]],
                               found_mu))
                 else:
-                    dbc.execute('''
-                        INSERT INTO versions
-                        (
-                            source_id,
-                            job_id,
-                            release,
-                            mu,
-                            os,
-                            package_name,
-                            package_version,
-                            package_filename
-                        ) VALUES (?,?,?,?,?,?,?,?)
-                        ''', (source_id,
-                              job_id,
-                              args.release,
-                              mu,
-                              args.os,
-                              package['Package'],
-                              package['Version'],
-                              package['Filename']))
+                    known[key] = source_id
+                    rows.append((source_id,
+                                 job_id,
+                                 args.release,
+                                 mu,
+                                 args.os) + key)
+            dbc.executemany('''
+                INSERT INTO versions
+                (
+                    source_id,
+                    job_id,
+                    release,
+                    mu,
+                    os,
+                    package_name,
+                    package_version,
+                    package_filename
+                ) VALUES (?,?,?,?,?,?,?,?)
+                ''', rows)
         db.commit()
 
     # validating arguments
@@ -244,7 +213,9 @@ def main(argv=None):
                                   'URL(s) to GA packages db file(s). '
                                   'If --os is ubuntu - "Packages" file(s), '
                                   'if --os is centos - '
-                                  '"...-primary.sqlite.bz2" file(s). '
+                                  '"...-primary.sqlite.bz2" or '
+                                  '"...-primary.xml.gz" file(s), '
+                                  'compressed or not. '
                                   'Local files are supported via '
                                   'file://<abs-path>. '
                                   'You must provide all URLs at once, like '
@@ -275,6 +246,16 @@ def main(argv=None):
                                  ))
         parser.add_argument('-j', '--job-id',
                             help='Optional. ID of the current Jenkins job.')
+        parser.add_argument('-t', '--threads', type=int, default=8,
+                            help=('Optional. Number of sources downloaded '
+                                  'concurrently (default: 8).'
+                                 ))
+        parser.add_argument('-p', '--processes', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help=('Optional. Number of processes used to '
+                                  'decompress and parse sources '
+                                  '(default: number of CPUs).'
+                                 ))
 
         args = parser.parse_args(argv[1:])
         args_check_error = verify_args()
@@ -285,15 +266,15 @@ def main(argv=None):
     if not args.updates_source:
         #GA db generation
         print('GA -> db generation...')
-        release_source = fetch(args.release_source)
+        release_source = parse(fetch(args.release_source))
         dbgen(sources=release_source, job_id=args.job_id)
     else:
         #MU db update
         print('MU -> db update...')
-        updates_source = fetch(args.updates_source)
-        updates_db = fetch([args.database])[args.database]
-        with open(args.output,'w') as file:
-            file.write(updates_db)
+        for _, updates_db in fetch([args.database]):
+            with open(args.output,'w') as file:
+                file.write(updates_db)
+        updates_source = parse(fetch(args.updates_source))
         dbgen(updates_source, args.mu_number, args.job_id)
 
 if __name__ == '__main__':
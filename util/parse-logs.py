@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+
+import versionsdb
+
+# package file names referenced in a log, like "/path/name_1.0_all.deb"
+PACKAGE = re.compile(r'/([^/*\s]+\.(?:deb|rpm))')
+# the job id is the "#<n>" on a line naming an update job, like
+# "jenkins-6.1.proposed-to-updates-..." or "jenkins-release-update-..."
+JOB_NAME = re.compile(
+    r'jenkins-(?:release-update|[\d.]+\.proposed-to-updates)-')
+JOB_ID = re.compile(r'#(\d+)')
+RELEASE_IN_NAME = re.compile(r'^(\d+(?:\.\d+)+)-')
+RELEASE_IN_LOG = re.compile(r'([\d.]+)-updates')
+
+
+def scan_log(path):
+    '''Process pool worker, reads a log once.
+
+    Returns (path, job_id, release from the log, {(os, name, version,
+    filename)}, error).
+    '''
+    job_id = None
+    release = None
+    packages = set()
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                if job_id is None and JOB_NAME.search(line):
+                    match = JOB_ID.search(line)
+                    if match:
+                        job_id = int(match.group(1))
+                if release is None:
+                    match = RELEASE_IN_LOG.search(line)
+                    if match:
+                        release = match.group(1)
+                if '.deb' not in line and '.rpm' not in line:
+                    continue
+                for filename in PACKAGE.findall(line):
+                    packages.add(versionsdb.split_filename(filename) +
+                                 (filename,))
+    except IOError as e:
+        return path, None, None, None, str(e)
+    return path, job_id, release, packages, None
+
+
+def log_release(path, release_in_log):
+    '''Release of a log named "<release>-...log", upgrade logs named
+    "<from>-to-<to>-...log" take it from the "<release>-updates" repo
+    mentioned in the log.'''
+    name = os.path.basename(path)
+    match = RELEASE_IN_NAME.match(name)
+    if '-to-' in name or not match:
+        return release_in_log
+    return match.group(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=('Add packages referenced in Jenkins update job logs to '
+                     'versions databases'))
+    parser.add_argument('-o', '--output', required=True,
+                        help=('Mandatory. Path to the versions database, '
+                              'created if missing. May contain {release} '
+                              'and {os} placeholders, for example '
+                              'db/versions/{release}/{os}.sqlite.'))
+    parser.add_argument('-n', '--mu-number', type=int, required=True,
+                        help='Mandatory. Integer ID of the MU update.')
+    parser.add_argument('-r', '--release',
+                        help=('Optional. Release of all logs, by default '
+                              'taken from the log file name ("6.1-*.log") '
+                              'or, for "*-to-*" logs, from the '
+                              '"<release>-updates" repo in the log.'))
+    parser.add_argument('-j', '--job-id', type=int,
+                        help=('Optional. ID of the Jenkins job of all logs, '
+                              'by default taken from the update job '
+                              '("jenkins-<release>.proposed-to-updates-" or '
+                              '"jenkins-release-update-") named in the '
+                              'log.'))
+    parser.add_argument('-s', '--os', choices=['ubuntu', 'centos'],
+                        help='Optional. Only add packages of this OS.')
+    parser.add_argument('-p', '--processes', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help=('Optional. Number of logs read in parallel '
+                              '(default: number of CPUs).'))
+    parser.add_argument('logs', nargs='+', help='Jenkins job log files.')
+    args = parser.parse_args(argv[1:])
+
+    # rows to add per output database, logs in command-line order
+    outputs = {}
+    pool = multiprocessing.Pool(max(1, min(args.processes, len(args.logs))))
+    try:
+        for path, job_id, release, packages, error in pool.imap(scan_log,
+                                                                args.logs):
+            if error:
+                sys.stderr.write('Error: %s: %s\n' % (path, error))
+                return 1
+            release = args.release or log_release(path, release)
+            if args.job_id is not None:
+                job_id = args.job_id
+            if not release:
+                sys.stderr.write('Error: cannot find the release of %s, '
+                                 'use -r\n' % path)
+                return 1
+            if job_id is None:
+                print('No Jenkins job id found in %s, use -j' % path)
+            for os_platform, name, version, filename in sorted(packages):
+                if args.os and os_platform != args.os:
+                    continue
+                output = args.output.format(release=release, os=os_platform)
+                outputs.setdefault(output, []).append(
+                    (path, job_id, release, os_platform, name, version,
+                     filename))
+    finally:
+        pool.terminate()
+
+    for output, rows in sorted(outputs.items()):
+        db = versionsdb.connect(output)
+        _, known = versionsdb.load_index(db)
+        sources = {}
+        new = []
+        for path, job_id, release, os_platform, name, version, filename \
+                in rows:
+            key = (release, args.mu_number, os_platform, name, version,
+                   filename)
+            if key in known:
+                continue
+            known.add(key)
+            if path not in sources:
+                sources[path] = versionsdb.source_id(
+                    db, 'file://' + os.path.abspath(path))
+            new.append((sources[path], job_id) + key)
+        versionsdb.insert(db, new)
+        db.commit()
+        db.close()
+        print('%s: %d packages added, %d already known' %
+              (output, len(new), len(rows) - len(new)))
+    return 0
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
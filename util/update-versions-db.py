@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+import argparse
+import collections
+import sys
+
+import versionsdb
+
+TYPES = ['packages', 'primary-sqlite', 'primary-xml']
+
+
+def source_type(source):
+    name = source.split('/')[-1]
+    if '.sqlite' in name:
+        return 'primary-sqlite'
+    if '.xml' in name:
+        return 'primary-xml'
+    return 'packages'
+
+
+def read_packages(source, stype):
+    data = versionsdb.fetch(source)
+    if stype == 'packages':
+        return versionsdb.packages_from_index(data)
+    return versionsdb.packages_from_primary(data,
+                                            xml=(stype == 'primary-xml'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=('Import packages of a repository into a versions '
+                     'database: new file names are added, file names '
+                     'already known with another name or version are '
+                     'updated in place'))
+    parser.add_argument('-r', '--release', required=True,
+                        help='Mandatory. Release version (example: 6.1).')
+    parser.add_argument('-s', '--os', required=True,
+                        choices=['ubuntu', 'centos'],
+                        help='Mandatory. OS of the packages.')
+    parser.add_argument('-n', '--mu-number', type=int, default=0,
+                        help=('Optional. Integer ID of the MU update, 0 '
+                              '(default) for GA packages.'))
+    parser.add_argument('-j', '--job-id', type=int, default=0,
+                        help='Optional. ID of the Jenkins job.')
+    parser.add_argument('-t', '--type', choices=TYPES,
+                        help=('Optional. Type of the sources - Debian '
+                              '"Packages" index, yum primary sqlite or xml '
+                              'database, by default detected by the file '
+                              'name. Sources can be .bz2 or .gz '
+                              'compressed.'))
+    parser.add_argument('-o', '--output', required=True,
+                        help=('Mandatory. Path to the versions database, '
+                              'created if missing.'))
+    parser.add_argument('sources', nargs='+',
+                        help='URLs or paths of the repository indexes.')
+    args = parser.parse_args(argv[1:])
+
+    db = versionsdb.connect(args.output)
+    by_filename, by_package = versionsdb.load_index(db)
+    known = set(key[3:] for key in by_package)
+    # id -> new (name, version, filename) of existing rows
+    updates = {}
+    # filename -> row (a list in versionsdb.COLUMNS order) to insert
+    inserts = collections.OrderedDict()
+    skipped = 0
+    for source in args.sources:
+        stype = args.type or source_type(source)
+        try:
+            packages = list(read_packages(source, stype))
+        except Exception as e:
+            sys.stderr.write('Error: cannot read %s: %s\n' % (source, e))
+            return 1
+        source_id = None
+        for name, version, filename in packages:
+            line = (name, version, filename)
+            if line in known:
+                skipped += 1
+                continue
+            known.add(line)
+            if filename in inserts:
+                inserts[filename][-3:] = line
+            elif filename in by_filename:
+                for row_id in by_filename[filename]:
+                    updates[row_id] = line
+            else:
+                if source_id is None:
+                    source_id = versionsdb.source_id(db, source)
+                inserts[filename] = [source_id, args.job_id, args.release,
+                                     args.mu_number, args.os] + list(line)
+    db.executemany('''
+        UPDATE versions
+        SET package_name = ?, package_version = ?, package_filename = ?
+        WHERE id = ?
+        ''', [line + (row_id,) for row_id, line in updates.items()])
+    versionsdb.insert(db, [tuple(row) for row in inserts.values()])
+    db.commit()
+    db.close()
+    print('%s: %d packages added, %d rows updated, %d already known' %
+          (args.output, len(inserts), len(updates), skipped))
+    return 0
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
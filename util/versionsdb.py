@@ -0,0 +1,255 @@
+'''Helpers shared by the tools which build versions databases.
+
+The schema is the one created by generate-db.py, the tools in this
+directory import this module because python adds the directory of a
+script to sys.path.
+'''
+
+import bz2
+import os
+import re
+import sqlite3
+import struct
+import subprocess
+import tarfile
+import tempfile
+import urllib2
+import zlib
+import xml.etree.ElementTree as ET
+from StringIO import StringIO
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+COLUMNS = ['source_id', 'job_id', 'release', 'mu', 'os',
+           'package_name', 'package_version', 'package_filename']
+
+# the same name/version split as the former shell tools
+RPM_NAME = re.compile(r'(.+?)-\d')
+RPM_VERSION = re.compile(r'.+?-(\d.+)\..+\.rpm$')
+
+
+def split_filename(filename):
+    '''Returns (os, name, version) of a .deb or .rpm file name, None for
+    other files.'''
+    if filename.endswith('.deb'):
+        parts = filename[:-len('.deb')].split('_')
+        return ('ubuntu', parts[0],
+                parts[1] if len(parts) > 1 else parts[0])
+    if filename.endswith('.rpm'):
+        name = RPM_NAME.match(filename)
+        version = RPM_VERSION.match(filename)
+        return ('centos',
+                name.group(1) if name else filename,
+                version.group(1) if version else filename)
+    return None
+
+
+def connect(filename):
+    '''Opens a versions database, creating the tables if needed.'''
+    db = sqlite3.connect(filename)
+    db.text_factory = str
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS sources
+        (
+            id INTEGER PRIMARY KEY,
+            source TEXT
+        )''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS versions
+        (
+            id INTEGER PRIMARY KEY,
+            source_id INTEGER,
+            job_id INTEGER,
+            release TEXT,
+            mu INTEGER,
+            os TEXT,
+            package_name TEXT,
+            package_version TEXT,
+            package_filename TEXT
+        )''')
+    return db
+
+
+def source_id(db, source):
+    '''Returns the id of a source, adding it if it is new.'''
+    r = db.execute('SELECT id FROM sources WHERE source = ?',
+                   (source,)).fetchone()
+    if r:
+        return r[0]
+    return db.execute('INSERT INTO sources (source) VALUES (?)',
+                      (source,)).lastrowid
+
+
+def load_index(db):
+    '''Loads the versions table into in-memory indexes.
+
+    Returns (by_filename, by_package): by_filename maps a package file name
+    to the ids of its rows, by_package is the set of
+    (release, mu, os, name, version, filename) of all rows.
+    '''
+    by_filename = {}
+    by_package = set()
+    for row in db.execute('''
+            SELECT id, release, mu, os, package_name, package_version,
+                   package_filename
+            FROM versions ORDER BY id'''):
+        by_filename.setdefault(row[6], []).append(row[0])
+        by_package.add(tuple(row[1:]))
+    return by_filename, by_package
+
+
+def insert(db, rows):
+    '''Inserts rows, tuples in COLUMNS order.'''
+    db.executemany('INSERT INTO versions (%s) VALUES (%s)' % (
+        ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), rows)
+
+
+def decompress(data, name):
+    '''Decompresses data read from a .gz, .bz2, .xz or .zst file name,
+    other data is returned as is.'''
+    if name.endswith('.gz'):
+        return zlib.decompress(data, zlib.MAX_WBITS | 16)
+    if name.endswith('.bz2'):
+        return bz2.decompress(data)
+    if name.endswith('.xz') and lzma is not None:
+        return lzma.decompress(data)
+    if name.endswith('.xz') or name.endswith('.zst'):
+        tool = 'xz' if name.endswith('.xz') else 'zstd'
+        p = subprocess.Popen([tool, '-dc'], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE)
+        out, _ = p.communicate(data)
+        if p.returncode:
+            raise ValueError('%s cannot decompress %s' % (tool, name))
+        return out
+    return data
+
+
+def fetch(source):
+    '''Reads a URL or a local path, decompressing it by its suffix.'''
+    if '://' in source:
+        data = urllib2.urlopen(source).read()
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+    return decompress(data, source)
+
+
+def packages_from_index(data):
+    '''Yields (name, version, filename) from a Debian "Packages" index.'''
+    for paragraph in re.split(r'\n{2,}', data):
+        fields = dict(re.findall(r'^(Package|Version|Filename): (.+)$',
+                                 paragraph, re.M))
+        if 'Package' in fields and 'Filename' in fields:
+            yield (fields['Package'], fields.get('Version', ''),
+                   fields['Filename'].split('/')[-1])
+
+
+def _rpm_version(epoch, version, release):
+    if epoch and epoch != '0':
+        return '%s:%s-%s' % (epoch, version, release)
+    return '%s-%s' % (version, release)
+
+
+def packages_from_primary(data, xml=False):
+    '''Yields (name, version, filename) of binary packages from a yum
+    primary database (sqlite) or, with xml=True, a primary.xml file.
+
+    Only source packages (*.src.rpm) are skipped, binary packages are
+    kept wherever the repository places them, not only under Packages/.'''
+    if xml:
+        for _, el in ET.iterparse(StringIO(data)):
+            if el.tag.split('}')[-1] != 'package':
+                continue
+            ns = el.tag[:-len('package')]
+            version = el.find(ns + 'version')
+            filename = el.find(ns + 'location').get('href').split('/')[-1]
+            if not filename.endswith('.src.rpm'):
+                yield (el.findtext(ns + 'name'),
+                       _rpm_version(version.get('epoch'), version.get('ver'),
+                                    version.get('rel')),
+                       filename)
+            el.clear()
+        return
+    with tempfile.NamedTemporaryFile() as tf:
+        tf.write(data)
+        tf.flush()
+        db = sqlite3.connect(tf.name)
+        db.text_factory = str
+        try:
+            for name, epoch, version, release, href in db.execute('''
+                    SELECT name, epoch, version, release, location_href
+                    FROM packages'''):
+                if href.endswith('.src.rpm'):
+                    continue
+                yield (name, _rpm_version(epoch, version, release),
+                       os.path.basename(href))
+        finally:
+            db.close()
+
+
+# rpm header tags and types used by read_rpm_header
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPM_INT32 = 4
+RPM_STRINGS = (6, 8, 9)
+
+
+def _rpm_header(f):
+    magic, _, count, size = struct.unpack('>4sIII', f.read(16))
+    if magic[:3] != '\x8e\xad\xe8':
+        raise ValueError('bad rpm header magic')
+    index = f.read(count * 16)
+    store = f.read(size)
+    tags = {}
+    for i in range(count):
+        tag, rtype, offset, _ = struct.unpack('>iiii',
+                                              index[i * 16:i * 16 + 16])
+        if rtype == RPM_INT32:
+            tags[tag] = struct.unpack('>i', store[offset:offset + 4])[0]
+        elif rtype in RPM_STRINGS:
+            tags[tag] = store[offset:store.index('\0', offset)]
+    return tags, size
+
+
+def read_rpm_header(f):
+    '''Returns (name, version) of an rpm package, only the headers are
+    read.'''
+    lead = f.read(96)
+    if lead[:4] != '\xed\xab\xee\xdb':
+        raise ValueError('not an rpm package')
+    _, size = _rpm_header(f)
+    # the signature header is padded to 8 bytes
+    f.read((8 - size % 8) % 8)
+    tags, _ = _rpm_header(f)
+    return (tags[RPMTAG_NAME],
+            _rpm_version(str(tags.get(RPMTAG_EPOCH, '')),
+                         tags[RPMTAG_VERSION], tags[RPMTAG_RELEASE]))
+
+
+def read_deb_control(f):
+    '''Returns (name, version) of a .deb package from its control member,
+    the data member is not read.'''
+    if f.read(8) != '!<arch>\n':
+        raise ValueError('not an ar archive')
+    while True:
+        header = f.read(60)
+        if len(header) < 60:
+            raise ValueError('no control member found')
+        name = header[:16].strip().rstrip('/')
+        size = int(header[48:58])
+        if name.startswith('control.tar'):
+            data = decompress(f.read(size), name)
+            tar = tarfile.open(fileobj=StringIO(data))
+            for member in tar:
+                if member.name.lstrip('./') == 'control':
+                    control = tar.extractfile(member).read()
+                    fields = dict(re.findall(
+                        r'^(Package|Version): *(\S+)', control, re.M))
+                    return fields['Package'], fields['Version']
+            raise ValueError('no control file in %s' % name)
+        f.seek(size + size % 2, os.SEEK_CUR)